@@ -0,0 +1,198 @@
+"""
+Benchmark suite for the PyQuaza forecast pipeline.
+
+Every benchmark runs on a frozen date with the weather served from a recorded fixture, so runs do not depend
+on the day or on the OpenWeatherMap API. Geocentric positions go to a throwaway ephemeris store, and forecasts
+never look up a precomputed globe grid (grid=False), so they always time the live pipeline. Each case is
+timed `repeat` times from a fresh setup, then run once more under tracemalloc for its peak memory. Results are
+saved as JSON named after the current commit, so two commits can be compared with --compare.
+
+Usage:
+    python benchmarks/run.py [--repeat N] [--only NAME ...] [--output FILE]
+    python benchmarks/run.py --compare OLD.json NEW.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import platform
+import subprocess
+import tracemalloc
+import warnings
+from datetime import date
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), 'pyquaza'))
+
+import numpy as np
+import pqFrame as pq
+import pqBodyForecast as bf
+import pqWeeklyForecast as wf
+import pqWeather
+import pqEphemeris
+import pqAnalytic
+
+START = date(2024, 3, 1)
+LAT, LONG, BODY = 24, -85, 'jupiter'
+FIXTURE = os.path.join(HERE, 'weather_fixture.json')
+RESULTS = os.path.join(HERE, 'results')
+
+WEATHER = pqWeather.WeatherProvider(backend=pqWeather.FixtureBackend(FIXTURE), cache_dir=None)
+SCRATCH = tempfile.mkdtemp(prefix='pyquaza-bench-')
+STORE = pqEphemeris.EphemerisStore(os.path.join(SCRATCH, 'ephemeris'))
+
+CASES = {}
+
+def case(function):
+    """Registers a benchmark. The function does the untimed setup and returns the callable to time."""
+    CASES[function.__name__] = function
+    return function
+
+def frame(ephemeris=STORE):
+    return pq.Transformations(LAT, LONG, START, weather=WEATHER, ephemeris=ephemeris)
+
+def body_forecast(*stages):
+    forecast = bf.BodyForecast(LAT, LONG, BODY, tf=frame(), image_file=None, grid=False)
+    for stage in stages:
+        getattr(forecast, stage)()
+    return forecast
+
+@case
+def frame_init():
+    return lambda: frame()
+
+@case
+def sun_for_me_cold():
+    return frame(pqEphemeris.EphemerisStore(tempfile.mkdtemp(dir=SCRATCH))).sun_for_me
+
+@case
+def sun_for_me():
+    return frame().sun_for_me
+
+@case
+def in_my_sky():
+    tf = frame()
+    return lambda: tf.in_my_sky(BODY)
+
+@case
+def in_my_sky_analytic():
+    tf = frame(pqAnalytic.AnalyticEphemeris())
+    return lambda: tf.in_my_sky(BODY)
+
+@case
+def set_body_df():
+    return body_forecast('body_this_week').set_body_df
+
+@case
+def cut_daytime():
+    return body_forecast('body_this_week', 'set_body_df').cut_daytime
+
+@case
+def best_time():
+    return body_forecast('body_this_week', 'set_body_df', 'cut_daytime').best_time
+
+@case
+def plot_onebody():
+    return body_forecast('body_this_week', 'set_body_df', 'cut_daytime', 'best_time').plot_onebody
+
+@case
+def plot_onebody_file():
+    forecast = body_forecast('body_this_week', 'set_body_df', 'cut_daytime', 'best_time')
+    forecast.image_file = os.path.join(SCRATCH, 'body.png')
+    return forecast.plot_onebody
+
+@case
+def milkyway_this_week():
+    return wf.WeeklyForecast(LAT, LONG, tf=frame(), image_file=None, grid=False).milkyway_this_week
+
+@case
+def run_all():
+    return bf.BodyForecast(LAT, LONG, BODY, tf=frame(), image_file=None, grid=False).run_all
+
+@case
+def get_plot():
+    return wf.WeeklyForecast(LAT, LONG, tf=frame(), image_file=None, grid=False).get_plot
+
+
+def measure(setup, repeat):
+    """Returns the timings (s) of repeat fresh runs and the peak traced memory (KiB) of one more."""
+    seconds = []
+    for _ in range(repeat):
+        function = setup()
+        began = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - began)
+
+    function = setup()
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return seconds, peak/1024
+
+def commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def run(names, repeat):
+    # Fill the shared store once so only the *_cold case pays for computing positions.
+    frame().locate(pqEphemeris.BODIES[:1])
+    results = {}
+    for name in names:
+        seconds, peak = measure(CASES[name], repeat)
+        results[name] = {'min_s': min(seconds), 'median_s': float(np.median(seconds)), 'peak_kib': peak,
+                         'repeat': repeat}
+        print(f"{name:<22} {min(seconds):9.4f} s  {np.median(seconds):9.4f} s  {peak:12.0f} KiB", flush=True)
+
+    return {'commit': commit(), 'start': START.isoformat(), 'location': [LAT, LONG], 'body': BODY,
+            'python': platform.python_version(), 'machine': platform.machine(),
+            'numpy': np.__version__, 'results': results}
+
+def compare(old_path, new_path):
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"{'case':<22} {old['commit']:>10} {new['commit']:>10}  ratio   peak ratio")
+    for name, result in new['results'].items():
+        before = old['results'].get(name)
+        if before is None:
+            print(f"{name:<22} {'-':>10} {result['min_s']:10.4f}")
+            continue
+        print(f"{name:<22} {before['min_s']:10.4f} {result['min_s']:10.4f} {result['min_s']/before['min_s']:6.2f}x"
+              f" {result['peak_kib']/max(before['peak_kib'], 1e-9):8.2f}x")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per case')
+    parser.add_argument('--only', nargs='+', choices=list(CASES), help='cases to run, defaults to all')
+    parser.add_argument('--output', help='results file, defaults to results/<commit>.json')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compare two results files')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    warnings.simplefilter('ignore')
+    pqWeather.set_default_provider(WEATHER)
+    try:
+        report = run(args.only or list(CASES), args.repeat)
+    finally:
+        shutil.rmtree(SCRATCH, ignore_errors=True)
+
+    output = args.output or os.path.join(RESULTS, f"{report['commit']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"saved {output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+Startup benchmark for the PyQuaza GUI.
+
+Each measurement runs in a fresh interpreter, so nothing is warm from an earlier run, from the pyquaza directory
+the GUI loads its images from. It reports how long it takes to import pqGUI, until the window has been shown and
+painted, and until the background preload of the forecast modules is done, next to what importing those modules
+eagerly used to cost before the window could appear. Qt runs on the offscreen platform unless QT_QPA_PLATFORM
+is set, so no display is needed.
+
+Usage:
+    python benchmarks/startup.py [--repeat N]
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PYQUAZA = os.path.join(os.path.dirname(HERE), 'pyquaza')
+
+# Child programs, each printing a JSON dict of seconds since the interpreter got to its first line.
+EAGER = """
+import time, json
+began = time.perf_counter()
+import pqBodyForecast, pqWeeklyForecast
+print(json.dumps({'import forecast modules': time.perf_counter() - began}))
+"""
+
+GUI = """
+import time, json
+began = time.perf_counter()
+marks = {}
+import pqGUI
+from PyQt5 import QtCore, QtWidgets
+marks['import pqGUI'] = time.perf_counter() - began
+app = QtWidgets.QApplication([])
+window = QtWidgets.QMainWindow()
+ui = pqGUI.Ui_MainWindow()
+ui.setupUi(window)
+window.show()
+app.processEvents()
+marks['window shown'] = time.perf_counter() - began
+
+def ready(seconds):
+    marks['preload done'] = time.perf_counter() - began
+    app.quit()
+
+ui.worker.ready.connect(ready)
+ui.worker.failed.connect(lambda generation, message: app.quit())
+QtCore.QTimer.singleShot(0, ui.worker.preload)
+QtCore.QTimer.singleShot(300000, app.quit)
+app.exec_()
+ui.worker.stop()
+print(json.dumps(marks))
+"""
+
+def measure(program):
+    """Runs a child program in a fresh interpreter and returns its marks, or None when it fails."""
+    env = dict(os.environ, QT_QPA_PLATFORM=os.environ.get('QT_QPA_PLATFORM', 'offscreen'),
+               PYTHONPATH=os.pathsep.join([PYQUAZA, os.environ.get('PYTHONPATH', '')]))
+    child = subprocess.run([sys.executable, '-c', program], cwd=PYQUAZA, env=env, capture_output=True, text=True)
+    if child.returncode != 0:
+        print(child.stderr.strip().splitlines()[-1] if child.stderr.strip() else f"exit {child.returncode}",
+              file=sys.stderr)
+        return None
+    return json.loads(child.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=3, help='fresh interpreters per measurement')
+    args = parser.parse_args()
+
+    runs = {}
+    for program in (EAGER, GUI):
+        for _ in range(args.repeat):
+            marks = measure(program)
+            if marks is None:
+                break
+            for name, seconds in marks.items():
+                runs.setdefault(name, []).append(seconds)
+
+    print(f"{'step':<26} {'min':>9}   {'median':>9}")
+    for name, seconds in runs.items():
+        print(f"{name:<26} {min(seconds):9.3f} s {np.median(seconds):9.3f} s")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,275 @@
+import time
+import numpy as np
+from datetime import date
+
+# Mean orbital elements referred to the ecliptic and equinox of date, as (value at d=0, rate per day) for
+# N (longitude of ascending node, deg), i (inclination, deg), w (argument of perihelion, deg),
+# a (semi-major axis, AU or Earth radii for the Moon), e (eccentricity) and M (mean anomaly, deg),
+# where d is the number of days since 1999 Dec 31.0 TT. Paul Schlyter, "How to compute planetary positions".
+ELEMENTS = {
+    'sun':     {'N': (0.0, 0.0), 'i': (0.0, 0.0), 'w': (282.9404, 4.70935e-5),
+                'a': (1.0, 0.0), 'e': (0.016709, -1.151e-9), 'M': (356.0470, 0.9856002585)},
+    'moon':    {'N': (125.1228, -0.0529538083), 'i': (5.1454, 0.0), 'w': (318.0634, 0.1643573223),
+                'a': (60.2666, 0.0), 'e': (0.054900, 0.0), 'M': (115.3654, 13.0649929509)},
+    'mercury': {'N': (48.3313, 3.24587e-5), 'i': (7.0047, 5.00e-8), 'w': (29.1241, 1.01444e-5),
+                'a': (0.387098, 0.0), 'e': (0.205635, 5.59e-10), 'M': (168.6562, 4.0923344368)},
+    'venus':   {'N': (76.6799, 2.46590e-5), 'i': (3.3946, 2.75e-8), 'w': (54.8910, 1.38374e-5),
+                'a': (0.723330, 0.0), 'e': (0.006773, -1.302e-9), 'M': (48.0052, 1.6021302244)},
+    'mars':    {'N': (49.5574, 2.11081e-5), 'i': (1.8497, -1.78e-8), 'w': (286.5016, 2.92961e-5),
+                'a': (1.523688, 0.0), 'e': (0.093405, 2.516e-9), 'M': (18.6021, 0.5240207766)},
+    'jupiter': {'N': (100.4542, 2.76854e-5), 'i': (1.3030, -1.557e-7), 'w': (273.8777, 1.64505e-5),
+                'a': (5.20256, 0.0), 'e': (0.048498, 4.469e-9), 'M': (19.8950, 0.0830853001)},
+    'saturn':  {'N': (113.6634, 2.38980e-5), 'i': (2.4886, -1.081e-7), 'w': (339.3939, 2.97661e-5),
+                'a': (9.55475, 0.0), 'e': (0.055546, -9.499e-9), 'M': (316.9670, 0.0334442282)},
+    'uranus':  {'N': (74.0005, 1.3978e-5), 'i': (0.7733, 1.9e-8), 'w': (96.6612, 3.0565e-5),
+                'a': (19.18171, -1.55e-8), 'e': (0.047318, 7.45e-9), 'M': (142.5905, 0.011725806)},
+    'neptune': {'N': (131.7806, 3.0173e-5), 'i': (1.7700, -2.55e-7), 'w': (272.8461, -6.027e-6),
+                'a': (30.05826, 3.313e-8), 'e': (0.008606, 2.15e-9), 'M': (260.2471, 0.005995147)},
+}
+
+BODIES = list(ELEMENTS)
+
+# Earth equatorial radius in AU, WGS84 flattening, and light travel time for 1 AU in days.
+EARTH_RADIUS = 6378.137/149597870.7
+FLATTENING = 1/298.257223563
+LIGHT_TIME = 499.004784/86400
+
+class AnalyticEphemeris:
+    """
+    Low-precision analytic ephemeris computing Sun, Moon and planet positions straight to altitude/azimuth.
+
+    Positions come from mean orbital elements of date with the main perturbation terms of the Moon, Jupiter,
+    Saturn and Uranus, solved with vectorized numpy. Planets are placed where Earth saw them one light travel
+    time earlier, which also covers most of their aberration, and every body is corrected for topocentric
+    parallax. Nutation, solar aberration and refraction are ignored, which keeps the error at the arcminute
+    level (see compare_with_astropy), plenty for picking a viewing time to the nearest
+    five minutes.
+
+    Pass an instance as the ephemeris of a pqFrame.Transformations to locate bodies without astropy's
+    get_body and frame transforms. It has no geocentric GCRS positions, so it cannot stand in for an
+    EphemerisStore in pqSites.
+    """
+    def altaz(self, body, timeframe, lat, long):
+        """
+        Returns the altitude (deg), azimuth (deg) and topocentric distance (AU) of a body.
+
+        Parameters
+        ----------
+        body : str
+            Sun, Moon or planet name.
+        timeframe : astropy Time
+            Times to locate the body at.
+        lat, long : float
+            Geodetic latitude and longitude of the viewing location in degrees.
+        """
+        d = np.atleast_1d(timeframe.tt.jd) - 2451543.5
+        xyz = self.equatorial(body.lower(), d)
+
+        # Greenwich mean sidereal time from UT (UTC is within a second of it) gives the local sidereal time.
+        jd_ut = np.atleast_1d(timeframe.utc.jd)
+        lst = np.radians(280.46061837 + 360.98564736629*(jd_ut - 2451545.0) + long)
+
+        # Subtract the observer's geocentric position on the WGS84 ellipsoid.
+        phi = np.radians(lat)
+        c = 1/np.sqrt(np.cos(phi)**2 + (1-FLATTENING)**2*np.sin(phi)**2)
+        rho_cos = EARTH_RADIUS*c*np.cos(phi)
+        rho_sin = EARTH_RADIUS*c*(1-FLATTENING)**2*np.sin(phi)
+        x = xyz[0] - rho_cos*np.cos(lst)
+        y = xyz[1] - rho_cos*np.sin(lst)
+        z = xyz[2] - rho_sin
+
+        distance = np.sqrt(x*x + y*y + z*z)
+        hour_angle = lst - np.arctan2(y, x)
+        dec = np.arcsin(z/distance)
+        alt = np.arcsin(np.sin(phi)*np.sin(dec) + np.cos(phi)*np.cos(dec)*np.cos(hour_angle))
+        az = np.arctan2(-np.cos(dec)*np.sin(hour_angle),
+                        np.sin(dec)*np.cos(phi) - np.cos(dec)*np.sin(phi)*np.cos(hour_angle))
+
+        return np.degrees(alt), np.degrees(az) % 360, distance
+
+    def equatorial(self, body, d):
+        """Returns the (3, N) geocentric equatorial position of a body in AU, equator and equinox of date."""
+
+        xyz = self.ecliptic(body, d)
+        if body not in ('sun', 'moon'):
+            # Light-time correction: where the planet was when the light left it.
+            xyz = self.ecliptic(body, d - LIGHT_TIME*np.sqrt((xyz**2).sum(axis=0)))
+
+        ecl = np.radians(23.4393 - 3.563e-7*d)
+        return np.array([xyz[0],
+                         xyz[1]*np.cos(ecl) - xyz[2]*np.sin(ecl),
+                         xyz[1]*np.sin(ecl) + xyz[2]*np.cos(ecl)])
+
+    def ecliptic(self, body, d):
+        """Returns the (3, N) geocentric ecliptic position of a body in AU, ecliptic and equinox of date."""
+
+        if body == 'sun':
+            lon, r = _sun(d)
+            return np.array([r*np.cos(lon), r*np.sin(lon), np.zeros_like(r)])
+
+        if body == 'moon':
+            lon, lat, r = _spherical(_orbit('moon', d))
+            lon, lat, r = _moon_perturbations(d, lon, lat, r)
+            r = r*EARTH_RADIUS
+        elif body in ('jupiter', 'saturn', 'uranus'):
+            lon, lat, r = _spherical(_orbit(body, d))
+            lon, lat = _planet_perturbations(body, d, lon, lat)
+        else:
+            return _orbit(body, d) + self.ecliptic('sun', d)
+
+        heliocentric = np.array([r*np.cos(lon)*np.cos(lat), r*np.sin(lon)*np.cos(lat), r*np.sin(lat)])
+        if body == 'moon':
+            return heliocentric
+
+        return heliocentric + self.ecliptic('sun', d)
+
+
+def _elements(body, d):
+    """Returns the orbital elements of a body at day numbers d, angles in radians."""
+
+    values = {name: start + rate*d for name, (start, rate) in ELEMENTS[body].items()}
+    for name in ('N', 'i', 'w', 'M'):
+        values[name] = np.radians(values[name])
+    return values
+
+def _anomaly(M, e):
+    """Solves Kepler's equation by Newton iteration and returns (true anomaly, radius over a)."""
+
+    E = M + e*np.sin(M)*(1 + e*np.cos(M))
+    for _ in range(4):
+        E = E - (E - e*np.sin(E) - M)/(1 - e*np.cos(E))
+    xv = np.cos(E) - e
+    yv = np.sqrt(1 - e*e)*np.sin(E)
+    return np.arctan2(yv, xv), np.hypot(xv, yv)
+
+def _orbit(body, d):
+    """Returns the (3, N) ecliptic position of a body in its orbit (heliocentric, geocentric for the Moon)."""
+
+    el = _elements(body, d)
+    v, r = _anomaly(el['M'], el['e'])
+    r = r*el['a']
+    vw = v + el['w']
+    return np.array([r*(np.cos(el['N'])*np.cos(vw) - np.sin(el['N'])*np.sin(vw)*np.cos(el['i'])),
+                     r*(np.sin(el['N'])*np.cos(vw) + np.cos(el['N'])*np.sin(vw)*np.cos(el['i'])),
+                     r*np.sin(vw)*np.sin(el['i'])])
+
+def _spherical(xyz):
+    r = np.sqrt((xyz**2).sum(axis=0))
+    return np.arctan2(xyz[1], xyz[0]), np.arcsin(xyz[2]/r), r
+
+def _sun(d):
+    """Returns the geocentric ecliptic longitude (rad) and distance (AU) of the Sun."""
+
+    el = _elements('sun', d)
+    v, r = _anomaly(el['M'], el['e'])
+    return v + el['w'], r
+
+def _moon_perturbations(d, lon, lat, r):
+    """Adds the largest solar perturbations to the Moon's longitude, latitude (rad) and distance (Earth radii)."""
+
+    moon, sun = _elements('moon', d), _elements('sun', d)
+    Mm, Ms = moon['M'], sun['M']
+    Lm = moon['M'] + moon['w'] + moon['N']
+    D = Lm - (sun['M'] + sun['w'])
+    F = Lm - moon['N']
+
+    dlon = (-1.274*np.sin(Mm - 2*D) + 0.658*np.sin(2*D) - 0.186*np.sin(Ms) - 0.059*np.sin(2*Mm - 2*D)
+            - 0.057*np.sin(Mm - 2*D + Ms) + 0.053*np.sin(Mm + 2*D) + 0.046*np.sin(2*D - Ms)
+            + 0.041*np.sin(Mm - Ms) - 0.035*np.sin(D) - 0.031*np.sin(Mm + Ms) - 0.015*np.sin(2*F - 2*D)
+            + 0.011*np.sin(4*D - Mm))
+    # The next largest terms not already in the Keplerian orbit (Meeus, "Astronomical Algorithms", table 47.A).
+    dlon += (-0.0125*np.sin(Mm + 2*F) + 0.0110*np.sin(Mm - 2*F) + 0.0085*np.sin(4*D - 2*Mm)
+             - 0.0079*np.sin(2*D + Ms - Mm) - 0.0068*np.sin(2*D + Ms) - 0.0052*np.sin(D - Mm)
+             + 0.0050*np.sin(D + Ms) + 0.0040*np.sin(2*D - Ms + Mm) + 0.0040*np.sin(2*D + 2*Mm)
+             + 0.0039*np.sin(4*D) + 0.0037*np.sin(2*D - 3*Mm))
+    dlat = (-0.173*np.sin(F - 2*D) - 0.055*np.sin(Mm - F - 2*D) - 0.046*np.sin(Mm + F - 2*D)
+            + 0.033*np.sin(F + 2*D) + 0.017*np.sin(2*Mm + F))
+    dr = -0.58*np.cos(Mm - 2*D) - 0.46*np.cos(2*D)
+
+    return lon + np.radians(dlon), lat + np.radians(dlat), r + dr
+
+def _planet_perturbations(body, d, lon, lat):
+    """Adds the mutual perturbations of Jupiter, Saturn and Uranus to their longitude and latitude (rad)."""
+
+    Mj = np.degrees(_elements('jupiter', d)['M'])
+    Ms = np.degrees(_elements('saturn', d)['M'])
+    Mu = np.degrees(_elements('uranus', d)['M'])
+    sin = lambda x: np.sin(np.radians(x))
+    cos = lambda x: np.cos(np.radians(x))
+
+    dlat = 0
+    if body == 'jupiter':
+        dlon = (-0.332*sin(2*Mj - 5*Ms - 67.6) - 0.056*sin(2*Mj - 2*Ms + 21) + 0.042*sin(3*Mj - 5*Ms + 21)
+                - 0.036*sin(Mj - 2*Ms) + 0.022*cos(Mj - Ms) + 0.023*sin(2*Mj - 3*Ms + 52)
+                - 0.016*sin(Mj - 5*Ms - 69))
+    elif body == 'saturn':
+        dlon = (0.812*sin(2*Mj - 5*Ms - 67.6) - 0.229*cos(2*Mj - 4*Ms - 2) + 0.119*sin(Mj - 2*Ms - 3)
+                + 0.046*sin(2*Mj - 6*Ms - 69) + 0.014*sin(Mj - 3*Ms + 32))
+        dlat = -0.020*cos(2*Mj - 4*Ms - 2) + 0.018*sin(2*Mj - 6*Ms - 49)
+    else:
+        dlon = 0.040*sin(Ms - 2*Mu + 6) + 0.035*sin(Ms - 3*Mu + 33) - 0.015*sin(Mj - Mu + 20)
+
+    return lon + np.radians(dlon), lat + np.radians(dlat)
+
+
+def compare_with_astropy(lat, long, start=None, bodies=BODIES, hours=168, n_samples=2016, ephemeris=None):
+    """
+    Bounds the error of AnalyticEphemeris against astropy over a forecast week (or any hours).
+
+    Both backends locate every body over the same time grid through pqFrame.Transformations, and the
+    angular separation between the two alt/az positions is measured. The astropy side reads its positions
+    from ephemeris, an EphemerisStore defaulting to the shared one. tests/test_analytic.py holds the bounds.
+
+    Returns
+    -------
+    dict
+        Body name mapped to the maximum separation (arcmin) and maximum relative distance error.
+    """
+    import pqFrame as pq
+
+    start = date.today() if start is None else start
+    analytic = pq.Transformations(lat, long, start, ephemeris=AnalyticEphemeris(), hours=hours, n_samples=n_samples)
+    reference = pq.Transformations(lat, long, start, ephemeris=ephemeris, hours=hours, n_samples=n_samples)
+    analytic.locate(bodies)
+    reference.locate(bodies)
+
+    errors = {}
+    for body in bodies:
+        a, b = analytic.body_tracks[body], reference.body_tracks[body]
+        alt1, alt2 = np.radians(a['alt']), np.radians(b['alt'])
+        cos_sep = (np.sin(alt1)*np.sin(alt2)
+                   + np.cos(alt1)*np.cos(alt2)*np.cos(np.radians(a['az'] - b['az'])))
+        separation = np.degrees(np.arccos(np.clip(cos_sep, -1, 1)))*60
+        errors[body] = {'arcmin': float(separation.max()),
+                        'distance': float(np.max(np.abs(a['distance']/b['distance'] - 1)))}
+
+    return errors
+
+def benchmark(lat=24, long=-85, start=None, bodies=BODIES, repeat=3):
+    """
+    Times locating every body over a forecast week with AnalyticEphemeris and with astropy.
+
+    The astropy timing reads positions from an already filled EphemerisStore, so it measures the frame
+    transform alone, the part a warm forecast pays on every new location.
+
+    Returns
+    -------
+    dict
+        Best wall-clock seconds for 'analytic' and 'astropy', and their ratio as 'speedup'.
+    """
+    import pqFrame as pq
+
+    start = date.today() if start is None else start
+    pq.Transformations(lat, long, start).locate(bodies[:1])
+    timings = {}
+    for name, ephemeris in [('analytic', AnalyticEphemeris()), ('astropy', None)]:
+        best = np.inf
+        for _ in range(repeat):
+            tf = pq.Transformations(lat, long, start, ephemeris=ephemeris)
+            began = time.perf_counter()
+            tf.locate(bodies)
+            best = min(best, time.perf_counter() - began)
+        timings[name] = best
+    timings['speedup'] = timings['astropy']/timings['analytic']
+
+    return timings
@@ -1,30 +1,190 @@
 import pqFrame as pq
-import pandas as pd
+import pqInstrument
+import pqSamples
+import pqVisibility
+import pqGlobe
 import numpy as np
-from datetime import datetime
-from matplotlib import pyplot as plt, dates
+import threading
+from matplotlib import dates, style
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 from astropy.visualization import astropy_mpl_style
 
 def cost_fx(cloud,alt):
     """ Define Cost function for finding the best time to observe a specified body
     
     Args: Cloud coverage value for given location and altitude value for body
+          (scalars or numpy arrays of matching shape)
     
     Returns: Calculated cost for each observation time within the given week
     
+    Any function with the same (cloud, alt) signature that operates element-wise
+    on numpy arrays can be passed to BodyForecast or WeeklyForecast in its place.
     """
     # Cost Calculation gives highest cost to cloud coverage because reduced visibility
     # prevents good observation opportunity
     cost = 100*(cloud)+((abs(alt-40)*10))
     return cost
 
+def best_index(cost):
+    """ Return the position of the lowest cost sample
+    
+    Args: Array of cost values
+    
+    Returns: Integer position of the minimum cost. Ties resolve to the earliest
+             sample, matching list.index(min(cost)).
+    """
+    return int(np.argmin(cost))
+
+def best_indices(cost, n):
+    """ Return the positions of the n lowest cost samples
+    
+    Args: Array of cost values and number of samples to keep
+    
+    Returns: Integer positions ordered from lowest to highest cost, ties
+             resolved to the earliest sample.
+    """
+    cost = np.asarray(cost)
+    n = min(n, cost.size)
+    if n <= 0:
+        return np.array([], dtype=int)
+    if n < cost.size:
+        candidates = np.argpartition(cost, n-1)[:n]
+        # argpartition does not keep ties stable, so widen to every sample that
+        # ties with the nth lowest cost before ordering.
+        candidates = np.flatnonzero(cost <= cost[candidates].max())
+    else:
+        candidates = np.arange(cost.size)
+    order = np.lexsort((candidates, cost[candidates]))
+    return candidates[order][:n]
+
+class PlotTemplate:
+    """ Create class PlotTemplate
+    
+        Reusable figure for BodyForecast.plot_onebody. The figure, axes,
+        colorbar and artists are built once and only have their data
+        replaced for each forecast. The figure is drawn on an Agg canvas
+        without pyplot, so it can be rendered from any thread; keep one
+        template per thread (see plot_template). The figure is sized and
+        laid out again by every render and save, after the data and labels
+        are in place, so neither depends on what was drawn before. Legend and
+        tick labels are made while drawing, so every draw, render and save
+        runs in the astropy style the figure was built in.
+    """
+    
+    def __init__(self, figsize=(6.5, 5.4)):
+        self.figsize = figsize
+        with style.context(astropy_mpl_style):
+            self.figure = Figure(figsize=figsize)
+            self.canvas = FigureCanvasAgg(self.figure)
+            self.ax = self.figure.add_subplot()
+            self.best, = self.ax.plot([], [], 'r*', markersize = 10, label = 'Best Time to Observe')
+            self.track = self.ax.scatter([], [], c=[], lw=0, s=15, cmap='viridis')
+            self.colorbar = self.figure.colorbar(self.track, ax=self.ax)
+            self.colorbar.set_label('Azimuth [deg]')
+            self.ax.xaxis.set_major_formatter(dates.DateFormatter('%m-%d %H:%M'))
+            self.ax.tick_params(axis='x', labelrotation=30)
+            self.ax.set_ylim(0, 90)
+            self.ax.set_xlabel('Viewing Date & Time')
+            self.ax.set_ylabel('Altitude [deg]')
+            self.message = self.figure.text(0.5, 0.5, '', ha='center', va='center', fontsize=20, visible=False)
+    
+    def draw(self, dts, alts, azs, best_dt, best_alt, body):
+        """ Replace the plotted night with new date, altitude and azimuth arrays """
+        
+        x = dates.date2num(dts)
+        with style.context(astropy_mpl_style):
+            self.track.set_offsets(np.column_stack([x, alts]))
+            self.track.set_array(np.asarray(azs))
+            self.track.autoscale()
+            self.track.set_label(body)
+            self.best.set_data([dates.date2num(best_dt)], [best_alt])
+            pad = max((x.max()-x.min())*0.05, 1/1440)
+            self.ax.set_xlim(x.min()-pad, x.max()+pad)
+            for label in self.ax.get_xticklabels(which='major'):
+                label.set_horizontalalignment('right')
+            self.ax.legend(loc = 'upper right')
+        self._show_plot(True)
+        
+    def draw_message(self, text):
+        """ Replace the plot with a text message """
+        
+        self.message.set_text(text)
+        self._show_plot(False)
+        
+    def render(self, size):
+        """ Draw the figure at size=(width, height) pixels and return it as an RGBA array """
+        
+        width, height = size
+        with style.context(astropy_mpl_style):
+            self._layout(width/self.figure.dpi, height/self.figure.dpi)
+            self.canvas.draw()
+        return np.array(self.canvas.buffer_rgba())
+    
+    def save(self, path, dpi):
+        """ Save the figure to path at its own figsize and the given dpi """
+        
+        with style.context(astropy_mpl_style):
+            self._layout(*self.figsize)
+            self.figure.savefig(path, dpi=dpi)
+    
+    def _layout(self, width, height):
+        # Size the figure in inches and fit the axes around the current
+        # tick labels. The message alone needs no layout.
+        self.figure.set_size_inches(width, height)
+        if self.ax.get_visible():
+            self.figure.tight_layout()
+    
+    def _show_plot(self, visible):
+        self.ax.set_visible(visible)
+        self.colorbar.ax.set_visible(visible)
+        self.message.set_visible(not visible)
+
+
+_templates = threading.local()
+
+def plot_template():
+    """ Return the PlotTemplate of the calling thread, creating it on first use """
+    
+    if not hasattr(_templates, 'template'):
+        _templates.template = PlotTemplate()
+    return _templates.template
+
+def grid_for(tf, cost, grid=None):
+    """ Return the precomputed grid that can answer forecasts for tf
+    
+    Args: pq.Transformations, cost function and a pqGlobe.GlobeGrid
+          (None looks up pqGlobe.default_grid, False disables the grid)
+    
+    Returns: The grid if it holds tf's site and time grid and cost is
+             cost_fx (the cost it was built for), None otherwise
+    """
+    grid = pqGlobe.default_grid(tf.start) if grid is None else grid
+    if grid and cost is cost_fx and grid.matches(tf):
+        return grid
+    return None
+
 class BodyForecast:
     """ Create class BodyForescast
     
         Attributes: lat (Latitude),
                     long (Longitude),
                     body (Celestial Body of choice)
-                    tf (transformation data from pq.Transformations)
+                    tf (transformation data from pq.Transformations, shared
+                        with other forecasts for the same location and day)
+                    cost (vectorized cost function, defaults to cost_fx)
+                    night_only (only locate the body at night samples, plus
+                        plot_margin samples either side, defaults to True)
+                    image_file (file plot_onebody saves the plot to, None
+                        renders it in memory to self.image instead,
+                        defaults to 'body.png')
+                    grid (pqGlobe.GlobeGrid to look the best time up in,
+                        defaults to the grid built for the week if any,
+                        False always computes it live). On a grid hit
+                        only the plot_margin samples either side of the
+                        best time are located, so samples, dataframe,
+                        df_night and best_night hold those rather than
+                        the whole week's nights
                     
         Functions:  body_this_week,
                     set_body_df,
@@ -38,13 +198,28 @@ class BodyForecast:
         a week time frame from a given location.
     """
     
+    # Number of samples plotted on each side of the best time.
+    plot_margin = 10
+    
+    # Resolution of the saved plot file and of a saved message (matplotlib's
+    # default, as the message was always saved), and pixel size of the
+    # in-memory image (the size of the pqGUI forecast widget).
+    file_dpi = 800
+    message_dpi = 100
+    display_size = (780, 650)
+    
     # Use built in Python method to assign latitude, longitude, body,
-    # and pq.Transformation values.
-    def __init__(self, lat, long, body):
+    # and pq.Transformation values. An existing pq.Transformations can be
+    # passed as tf to reuse the sky state it has already computed.
+    def __init__(self, lat, long, body, cost=cost_fx, tf=None, night_only=True, image_file='body.png', grid=None):
         self.lat = lat
         self.long = long
         self.body = body
-        self.tf = pq.Transformations(self.lat, self.long)
+        self.cost = cost
+        self.night_only = night_only
+        self.image_file = image_file
+        self.tf = tf if tf is not None else pq.sky_session(self.lat, self.long)
+        self.grid = grid
         
     def body_this_week(self):
         """ Create body_this_week function
@@ -52,12 +227,33 @@ class BodyForecast:
             Takes data from pq.Transformations and converts it to the necessary
             data for this module: Body altitude-azimuth, Sun Altitude-Azimuth,
             time frame for observation, and delta time from starting time.
+            
+            The Sun is located first so that, with night_only set, the body
+            is only transformed at astronomical night samples (and the few
+            samples around them that plot_onebody draws). With an adaptive
+            pq.Transformations only the night samples it refines are used.
+            When a pqGlobe.GlobeGrid holds the site, the best time is looked
+            up there with the live cloud forecast (self.grid_best) and only
+            the samples plot_onebody draws around it are located.
         """
         
-        self.body_altaz = self.tf.in_my_sky(self.body)
-        self.sun_altaz = self.tf.sun_for_me()
-        self.timeframe = self.tf.timeframe
-        self.delta_time = self.tf.delta_time
+        grid = grid_for(self.tf, self.cost, self.grid) if self.night_only else None
+        self.grid_best = grid.best(self.lat, self.long, self.body, self.tf.check_weather(), self.cost) \
+            if grid is not None else None
+        
+        if self.grid_best is not None:
+            best = self.grid_best['sample']
+            self.samples = np.arange(max(best - self.plot_margin, 0),
+                                     min(best + self.plot_margin + 1, len(self.tf.timeframe)))
+        elif self.night_only:
+            self.samples = self.tf.samples_for(self.body, self.cost, margin=self.plot_margin)
+        else:
+            self.samples = np.arange(len(self.tf.timeframe))
+        self.sun_altaz = self.tf.sun_for_me(self.samples)
+        self.body_altaz = self.tf.in_my_sky(self.body, self.samples)
+        self.timeframe = self.tf.timeframe[self.samples]
+        self.delta_time = self.tf.delta_time[self.samples]
+        pqInstrument.count('samples', len(self.samples))
         
         return self.body_altaz, self.sun_altaz, self.timeframe, self.delta_time
     
@@ -65,34 +261,31 @@ class BodyForecast:
     def set_body_df(self):
         """ Create set_body_df function
             
-            Takes data obtained in body_this_week and generates a dataframe
-            that can be easily used in future functions.
+            Takes data obtained in body_this_week and collects it into a
+            pqSamples.SampleBlock (float32 columns sharing the sample axis,
+            calendar fields only decoded for the best time) that can be
+            easily used in future functions. The dataframe attribute
+            converts it to a pandas DataFrame indexed by sample number.
         """
         
-        # Create cloud coverage data set.
-        clouds = self.tf.check_weather()
+        self.block = pqSamples.SampleBlock.from_transformations(self.tf, [self.body], self.samples)
         
-        # Generate dictionary with all data needed for future analysis.
-        data = {'day': self.timeframe.ymdhms.day,
-                'month': self.timeframe.ymdhms.month,
-                'year': self.timeframe.ymdhms.year,
-                'hour': self.timeframe.ymdhms.hour,
-                'minute': self.timeframe.ymdhms.minute,
-                'deltahrs' : self.delta_time,
-                'sunalt': self.sun_altaz.alt,
-                'bodyalt' :self.body_altaz.alt,
-                'bodyaz' : self.body_altaz.az,
-                'clouds': np.repeat(clouds,288)}
-        
-        # Convert dictionary into data frame.
-        self.dataframe = pd.DataFrame(data)
-        
-        return self.dataframe
+        return self.block
+    
+    @property
+    def dataframe(self):
+        # DataFrame view of the samples, built on demand for notebook users.
+        return self.block.to_dataframe(self.body)
+    
+    @property
+    def df_night(self):
+        # DataFrame view of the night samples, built on demand.
+        return self.night_block.to_dataframe(self.body)
     
     def cut_daytime(self):
         """ Create cut_daytime function
             
-            Removes all daytime data from dataframe generated in set_body_df
+            Removes all daytime data from the samples collected in set_body_df
             by removing all values where the sun altitude is above -18 degrees
             of the observers horizon. 
             This helps reduce the data points used in analysis and thus makes
@@ -100,9 +293,10 @@ class BodyForecast:
         """
         
         # Use mask to remove daytime data
-        self.df_night = self.dataframe[self.dataframe['sunalt']<-18]
+        self.night_block = self.block.night()
+        pqInstrument.count('night_samples', len(self.night_block))
         
-        return self.df_night
+        return self.night_block
     
     
     def best_time(self):
@@ -114,41 +308,96 @@ class BodyForecast:
             the best time and best date for observing the desired body.
         """
         
-        cost = []
+        # Evaluate the cost function over the whole night at once.
+        cost = self.night_block.cost(self.cost)[0]
         
-        # Generate for loop to run all data points through cost function and
-        # add values to cost list.
-        for i in self.df_night.index:
-            cost.append(cost_fx(self.df_night.clouds[i],self.df_night.bodyalt[i]))
+        # Find min cost and decode the calendar fields of that sample only.
+        # The best night is every night sample on the same forecast day.
+        self.i_best = best_index(cost)
+        self.best_time_val = self.night_block.row(0, self.i_best)
+        day = self.night_block.day()
+        self.best_night = self.night_block.select(day == day[self.i_best])
         
-        # Find min cost and obtain values using the index.
-        self.i_best = cost.index(min(cost))
-        self.best_time_val = self.df_night.iloc[self.i_best]
-        best_day = self.best_time_val.day
-        self.best_night = self.df_night[self.df_night['day']==best_day]
+        # Index the dark windows with the body above the horizon, so the
+        # visibility of the best night is a lookup rather than a scan. The
+        # index is kept on the shared tf and only rebuilt when its tracks
+        # gain samples.
+        self.visibility = pqVisibility.VisibilityIndex.cached(self.tf, self.body, self.samples)
         
         return self.best_time_val, self.best_night, self.i_best
     
     
-    def plot_onebody(self):
-        """ Create plot_onebody function
+    def stream(self, hours=168, n_samples=2016, chunk=2016, sun_limit=-18):
+        """ Create stream function
         
-            Takes data obtained in best_time and set_body_df to create plot 
-            for desired body best observation time and also plot the data
-            for the night when the body can be best observed. 
-            If values for observations are below horizon (altitude > 0), then
-            body cannot be observed from user's location and message will
-            appear instead of plot.
+            Finds the best time over a horizon of any length and sample
+            rate without holding it in memory. The horizon is walked in
+            windows of chunk samples (see pq.stream), locating the body at
+            the dark samples of each window only, and all that is kept is
+            the best sample so far and one summary per forecast night.
+            
+            This is a generator yielding (best_time_val, nights) after
+            every window, so progress can be shown as it goes. best_time_val
+            is the row of the best sample so far (named by its index in the
+            whole grid, None before any dark sample) and nights is a list of
+            dicts with the day, number of dark samples, lowest cost, its
+            sample, highest body altitude and cloud coverage of every night
+            seen. Both are also kept on the forecast.
+            
+            Positions are computed in memory for each window (the Sun and
+            this body only) rather than through the ephemeris store, unless
+            tf uses an analytic ephemeris, which is used as well.
+            The cloud forecast only covers its first days (forecast_days on
+            pq.Transformations). Later nights reuse the coverage of its last
+            day and are flagged with forecast False, as is best_forecast
+            when the best time falls on one of them.
         """
-        # Get best time values using index obrained in best_time function.
-        df_best_time = self.df_night.iloc[self.i_best]
-        # Remove values where body would be below horizon
-        cut_negative = self.best_night[self.best_night['bodyalt']>0]
-        
-        # Open subplot.
-        fig, ax = plt.subplots();
+        self.best_time_val = None
+        self.nights = []
+        best_cost = np.inf
+        nights = {}
+        self.best_forecast = True
+        ephemeris = self.tf.ephemeris if hasattr(self.tf.ephemeris, 'altaz') else None
+        for tf in pq.stream(self.lat, self.long, self.tf.start, hours, n_samples, chunk,
+                            weather=self.tf.weather, ephemeris=ephemeris):
+            forecast_days = tf.forecast_days()
+            samples = tf.night_samples(sun_limit=sun_limit)
+            tf.locate([self.body], samples)
+            block = pqSamples.SampleBlock.from_transformations(tf, [self.body], samples).night(sun_limit)
+            pqInstrument.count('samples', len(block))
+            if len(block):
+                cost = block.cost(self.cost)[0]
+                day = block.day()
+                for d in np.unique(day):
+                    on_day = np.flatnonzero(day == d)
+                    i = on_day[best_index(cost[on_day])]
+                    night = nights.setdefault(int(d), {'day': int(d), 'samples': 0, 'cost': np.inf, 'sample': -1,
+                                                       'peak_alt': -np.inf, 'clouds': float(block.clouds[i]),
+                                                       'forecast': bool(d < forecast_days)})
+                    night['samples'] += on_day.size
+                    night['peak_alt'] = max(night['peak_alt'], float(block.alt[0, on_day].max()))
+                    if cost[i] < night['cost']:
+                        night.update(cost=float(cost[i]), sample=tf.offset + int(block.samples[i]))
+                
+                # Strictly lower costs only, so ties keep the earliest sample.
+                i = best_index(cost)
+                if cost[i] < best_cost:
+                    best_cost = cost[i]
+                    self.best_time_val = block.row(0, i).rename(tf.offset + int(block.samples[i]))
+                    self.best_forecast = bool(day[i] < forecast_days)
+            
+            self.nights = [nights[d] for d in sorted(nights)]
+            yield self.best_time_val, self.nights
+    
+    
+    def best_text(self):
+        """ Create best_text function
         
-        # Generate variables so that it is easier to write in plot functions.
+            Formats the best time found by best_time as the text shown next
+            to the plot. Only needs best_time, so it can be shown before the
+            plot has been drawn.
+        """
+        # Generate variables so that it is easier to write in the text.
         day = int(self.best_time_val.day)
         month = int(self.best_time_val.month)
         year = int(self.best_time_val.year)
@@ -157,65 +406,91 @@ class BodyForecast:
         cloud = int(self.best_time_val.clouds)
         az = self.best_time_val.bodyaz
         
-        # Create if statement. If dataframe is empty after removing values where
-        # body is below horizon, then give message that body is not visible at the time.
-        if cut_negative.empty:
-            fig = plt.figure(figsize = (12,8))
-            plt.grid(False)
-            plt.annotate('Body cannot be seen this week.',(0.5,0.5),ha='center',va='center',fontsize=24)
-            plt.savefig('body.png')
+        return f"Best View Date: \n{month}/{day}/{year} \n\nBest View Time: \n{hour} HR {minute} min \n\nCloud Coverage: \n{cloud}% \n\nAzimuth Position: \n{az:.2f}°"
+    
+    
+    def is_visible(self):
+        """ Create is_visible function
+        
+            Returns whether the body rises above the horizon (altitude > 0)
+            during the dark part of the best night found by best_time,
+            looked up in the visibility index (or the grid for a grid hit).
+        """
+        if self.grid_best is not None:
+            return self.grid_best['peak'] > 0
+        night = self.tf.delta_time[self.best_night.samples[[0, -1]]].to_value('hour')
+        return self.visibility.is_visible(*night)
+    
+    
+    def plot_onebody(self):
+        """ Create plot_onebody function
+        
+            Takes data obtained in best_time and set_body_df to create plot 
+            for desired body best observation time and also plot the data
+            for the night when the body can be best observed. 
+            If values for observations are below horizon (altitude > 0), then
+            body cannot be observed from user's location and message will
+            appear instead of plot.
+            The plot is drawn on the reusable PlotTemplate of the calling
+            thread. With image_file set it is saved there at file_dpi,
+            otherwise it is rendered in memory at display_size and kept as
+            an RGBA array in self.image.
+        """
+        template = plot_template()
+        
+        # Create if statement. If no sample of the best night has the body
+        # above the horizon, then give message that body is not visible at the time.
+        if not self.is_visible():
+            template.draw_message('Body cannot be seen this week.')
             figText = ""
-            plt.close()
         
         # Otherwise, plot best time to observe and body location throughout the
         # night when it is best to observe it.
         else:
-            besttime = self.dataframe.loc[self.dataframe['deltahrs'] == df_best_time.deltahrs]
-            besttimei = besttime.index
-            besttime_dt = datetime(int(besttime.year), int(besttime.month), int(besttime.day), int(besttime.hour), int(besttime.minute))
-            besttime_alt = besttime.bodyalt
-
-            index = np.arange(besttimei[0]-10,besttimei[0]+11,1)
-            dts = []
-            alts = []
-            azs = []
-            
-            # Create data sets with date, body altitude, and body azimuth to plot using for loop.
-            for i in index:
-                bfdf = self.dataframe.iloc[[i]]
-                dts.append(datetime(int(bfdf.year), int(bfdf.month), int(bfdf.day), int(bfdf.hour), int(bfdf.minute)))
-                alts.append(bfdf.bodyalt)
-                azs.append(bfdf.bodyaz)
+            # Sample number of the best time in the full week.
+            besttimei = self.night_block.samples[self.i_best]
             
-            # Plot datasets obtained. Azimuth will be plotted as a color gradient,
-            # The overall plot will have a star for denoting the best time for observation
-            # and the body's altitude throught the same night plotted.
-            plt.style.use(astropy_mpl_style);            
-            ax.xaxis.set_major_formatter(dates.DateFormatter('%m-%d %H:%M'));
-            for label in ax.get_xticklabels(which='major'):
-                label.set(rotation=30, horizontalalignment='right');
-            plt.plot(besttime_dt, besttime_alt, 'r*', markersize = 10, label = 'Best Time to Observe');
-            plt.scatter(dts, alts, c=azs, label= f'{self.body.capitalize()}', lw=0, s=15, cmap='viridis');
-            plt.colorbar().set_label('Azimuth [deg]');
-            plt.legend(loc = 'upper right');
-            plt.ylim(0, 90);
-            plt.xlabel('Viewing Date & Time');
-            plt.ylabel('Altitude [deg]');
-            plt.tight_layout()
-            plt.savefig('body.png', dpi=800)
-            plt.close()
-            figText = f"Best View Date: \n{month}/{day}/{year} \n\nBest View Time: \n{hour} HR {minute} min \n\nCloud Coverage: \n{cloud}% \n\nAzimuth Position: \n{az:.2f}°"
+            # Take the date, body altitude, and body azimuth series to plot
+            # from the samples within plot_margin of the best time.
+            window = self.block.select(np.abs(self.block.samples - besttimei) <= self.plot_margin)
+            dts = window.datetimes()
             
-        self.fig = fig
+            # Azimuth is plotted as a color gradient, with a star denoting the
+            # best time for observation.
+            template.draw(dts, window.alt[0], window.az[0], dts[window.samples == besttimei][0],
+                          self.best_time_val.bodyalt, self.body.capitalize())
+            figText = self.best_text()
+        
+        if self.image_file is not None:
+            dpi = self.file_dpi if template.ax.get_visible() else self.message_dpi
+            with pqInstrument.span('savefig', dpi=dpi):
+                template.save(self.image_file, dpi)
+            self.image = None
+        else:
+            with pqInstrument.span('render'):
+                self.image = template.render(self.display_size)
+        
+        self.fig = template.figure
         self.figText = figText
         
         return 
     
-    def run_all(self):
+    def run_all(self, progress=None, timer=None):
+        """ Create run_all function
         
-        self.body_this_week()
-        self.set_body_df()
-        self.cut_daytime()
-        self.best_time()
-        self.plot_onebody()
+            Runs every stage from body_this_week to plot_onebody. If given,
+            progress(stage, forecast) is called with the name of each stage
+            and this forecast before the stage runs, e.g. to report progress
+            or to show best_text before the plot is drawn. An exception
+            raised by progress stops the remaining stages.
+            With a pqInstrument.Timer as timer, every stage is recorded as
+            a span along with the transforms, weather lookups and cache
+            hits inside it (see timer.report()).
+        """
+        with pqInstrument.activate(timer), pqInstrument.span('run_all', body=self.body):
+            for stage in ['body_this_week', 'set_body_df', 'cut_daytime', 'best_time', 'plot_onebody']:
+                if progress is not None:
+                    progress(stage, self)
+                with pqInstrument.span(stage):
+                    getattr(self, stage)()
         return
\ No newline at end of file
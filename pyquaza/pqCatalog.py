@@ -0,0 +1,155 @@
+import os
+import time
+import numpy as np
+import pandas as pd
+import pqFrame as pq
+import pqBodyForecast as bf
+import pqInstrument
+from astropy import units as u
+from astropy.coordinates import SkyCoord, AltAz
+
+# Example catalog of bright deep-sky objects and stars shipped next to this module.
+CATALOG = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'catalog.csv')
+
+def load_catalog(path=CATALOG, max_mag=None):
+    """
+    Reads a catalog of fixed targets.
+
+    Parameters
+    ----------
+    path : str
+        CSV file with name, ra and dec (ICRS, degrees) columns and any others (e.g. mag, type), which are
+        carried through to the forecast. Lines starting with # are skipped.
+    max_mag : float, optional
+        Drops targets fainter than this visual magnitude (needs a mag column).
+
+    Returns
+    -------
+    pandas DataFrame
+        One row per target.
+    """
+    catalog = pd.read_csv(path, comment='#', skipinitialspace=True)
+    if max_mag is not None:
+        catalog = catalog[catalog['mag'] <= max_mag].reset_index(drop=True)
+    return catalog
+
+def sky_rotation(tf, samples):
+    """
+    Returns the matrices rotating ICRS unit vectors into the AltAz frame of a Transformations at sample indices.
+
+    Targets outside the solar system only differ by direction, so rather than transforming every target the
+    three ICRS axes are transformed once per sample with astropy and every target follows by a matrix product.
+    Stellar aberration is not quite a rotation, so altitudes differ from a full transform by under an arcminute.
+
+    Returns
+    -------
+    numpy Array
+        Shaped (sample, 3, 3); column i is ICRS axis i as (x, y, z) = (cos(alt)cos(az), cos(alt)sin(az), sin(alt)).
+    """
+    obstime = tf.timeframe[samples]
+    axes = SkyCoord(ra=[0, 90, 0]*u.deg, dec=[0, 0, 90]*u.deg, frame='icrs')[:, np.newaxis]
+    altaz = axes.transform_to(AltAz(obstime=obstime, location=tf.backyard))
+    return np.moveaxis(altaz.cartesian.xyz.value, (0, 1), (1, 2))
+
+def forecast_catalog(lat, long, catalog=None, top=10, cost=bf.cost_fx, tf=None, memory=64*2**20, sun_limit=-18,
+                     min_alt=0):
+    """
+    Ranks the targets of a catalog for every night of the week and returns the top ones per night.
+
+    Every target is evaluated at every night sample of the week: the sky rotation of each sample (see
+    sky_rotation) is applied to all target directions with one matrix product per chunk of targets, chunks
+    being sized so their (sample, 3, target) direction vectors stay within memory bytes. The cost function is evaluated on
+    the whole chunk at once, and for every night the best sample of each target is kept.
+
+    Parameters
+    ----------
+    lat, long : float
+        Viewing location in degrees.
+    catalog : pandas DataFrame or str, optional
+        Targets as from load_catalog, or the path of a catalog file, defaults to the example CATALOG.
+    top : int
+        Number of targets kept per night.
+    cost : function
+        Vectorized cost(cloud, alt) function.
+    tf : pqFrame.Transformations, optional
+        Source of the time grid, Sun track and cloud forecast, defaults to pqFrame.sky_session(lat, long).
+    memory : int
+        Bytes allowed for the direction vectors of one chunk of targets.
+    sun_limit : float
+        Sun altitude (deg) below which samples count as night.
+    min_alt : float
+        Targets that stay below this altitude (deg) all night are not ranked.
+
+    Returns
+    -------
+    pandas DataFrame
+        One row per night and rank with the day (0 for the first forecast day), rank, the catalog columns,
+        and the best sample, time (UTC), alt, az, clouds and cost of the target that night.
+    """
+    catalog = load_catalog(catalog) if isinstance(catalog, str) else (load_catalog() if catalog is None else catalog)
+    tf = tf if tf is not None else pq.sky_session(lat, long)
+    samples = tf.night_samples(sun_limit=sun_limit)
+    if samples.size == 0 or len(catalog) == 0:
+        return pd.DataFrame(columns=['day', 'rank', *catalog.columns, 'sample', 'time', 'alt', 'az', 'clouds', 'cost'])
+
+    with pqInstrument.span('sky_rotation'):
+        rotation = sky_rotation(tf, samples)
+    ra, dec = np.radians(catalog['ra'].to_numpy(float)), np.radians(catalog['dec'].to_numpy(float))
+    targets = np.stack([np.cos(dec)*np.cos(ra), np.cos(dec)*np.sin(ra), np.sin(dec)])
+    clouds = tf.clouds_for(samples).astype(float)
+    day = (tf.delta_time[samples].to_value(u.hour)//24).astype(int)
+    days = np.unique(day)
+    nights = [np.flatnonzero(day == night) for night in days]
+
+    # Best cost and sample position of every target on every night.
+    n_targets = targets.shape[1]
+    best_cost = np.full((days.size, n_targets), np.inf)
+    best_i = np.zeros((days.size, n_targets), dtype=int)
+    chunk = max(1, int(memory//(3*8*samples.size)))
+    with pqInstrument.span('rank', targets=n_targets, samples=samples.size):
+        for lo in range(0, n_targets, chunk):
+            alt, _ = _altaz(rotation @ targets[:, lo:lo+chunk])
+            sample_cost = np.asarray(cost(clouds[:, np.newaxis], alt), dtype=float)
+            sample_cost[alt <= min_alt] = np.inf
+            for d, rows in enumerate(nights):
+                i = np.argmin(sample_cost[rows], axis=0)
+                best_i[d, lo:lo+chunk] = rows[i]
+                best_cost[d, lo:lo+chunk] = sample_cost[rows[i], np.arange(i.size)]
+
+    frames = []
+    for d, night in enumerate(days):
+        ranked = np.argsort(best_cost[d], kind='stable')[:top]
+        ranked = ranked[np.isfinite(best_cost[d, ranked])]
+        i = best_i[d, ranked]
+        alt, az = _altaz(np.einsum('nij,jn->in', rotation[i], targets[:, ranked]), axis=0)
+        frame = catalog.iloc[ranked].reset_index(drop=True)
+        frame.insert(0, 'rank', np.arange(1, ranked.size+1))
+        frame.insert(0, 'day', night)
+        frame['sample'] = samples[i]
+        frame['time'] = tf.timeframe[samples[i]].to_datetime() if ranked.size else []
+        frame['alt'] = alt
+        frame['az'] = az
+        frame['clouds'] = clouds[i]
+        frame['cost'] = best_cost[d, ranked]
+        frames.append(frame)
+
+    return pd.concat(frames, ignore_index=True)
+
+def _altaz(xyz, axis=-2):
+    # Altitude and azimuth (deg) of AltAz unit vectors stacked along axis. atan2 keeps the altitude accurate
+    # near the zenith, where arcsin of z is ill-conditioned.
+    x, y, z = np.moveaxis(xyz, axis, 0)
+    return np.degrees(np.arctan2(z, np.hypot(x, y))), np.degrees(np.arctan2(y, x)) % 360
+
+def benchmark(n_targets=10000, lat=24, long=-85, seed=0):
+    """Ranks n_targets random targets and returns the seconds taken, after the Sun track is in place."""
+
+    rng = np.random.default_rng(seed)
+    catalog = pd.DataFrame({'name': [f"target {i}" for i in range(n_targets)],
+                            'ra': rng.uniform(0, 360, n_targets),
+                            'dec': np.degrees(np.arcsin(rng.uniform(-1, 1, n_targets)))})
+    tf = pq.sky_session(lat, long)
+    tf.night_samples()
+    began = time.perf_counter()
+    forecast_catalog(lat, long, catalog, tf=tf)
+    return time.perf_counter() - began
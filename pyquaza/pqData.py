@@ -0,0 +1,137 @@
+import os
+import json
+import time
+import shutil
+import numpy as np
+import pqFrame as pq
+import pqEphemeris
+import pqInstrument
+from datetime import datetime, timezone
+from astropy.time import Time
+from astropy.utils import iers
+from astropy.utils.data import conf as data_conf, download_file
+
+CACHE_DIR = os.environ.get('PYQUAZA_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.pyquaza'))
+
+# Directory prefetch() bundles the Earth rotation tables in and configure() pins astropy to.
+DATA_DIR = os.environ.get('PYQUAZA_DATA_DIR', os.path.join(CACHE_DIR, 'iers'))
+
+# Bundled file name and download locations (first that answers wins) of each table.
+TABLES = {'finals2000A.all': [iers.conf.iers_auto_url, iers.conf.iers_auto_url_mirror],
+          'Leap_Second.dat': [iers.conf.iers_leap_second_auto_url]}
+
+def prefetch(directory=DATA_DIR, timeout=30):
+    """
+    Downloads the IERS-A Earth orientation table and the leap second table into directory.
+
+    Run it wherever the network is available (e.g. when deploying, or nightly) and copy the directory to
+    hosts without it. Files are written under a temporary name and renamed into place, and a manifest.json
+    records where and when each was fetched.
+
+    Returns
+    -------
+    dict
+        The manifest, file name to {'url', 'fetched'}.
+    """
+    os.makedirs(directory, exist_ok=True)
+    manifest = {}
+    for name, urls in TABLES.items():
+        errors = []
+        for url in urls:
+            try:
+                downloaded = download_file(url, cache=False, timeout=timeout)
+            except OSError as err:
+                errors.append(f"{url}: {err}")
+                continue
+            path = os.path.join(directory, name)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            shutil.move(downloaded, tmp)
+            os.replace(tmp, path)
+            manifest[name] = {'url': url, 'fetched': datetime.now(timezone.utc).isoformat(timespec='seconds')}
+            break
+        else:
+            raise OSError(f"could not fetch {name}: " + '; '.join(errors))
+
+    with open(os.path.join(directory, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=1)
+    return manifest
+
+def configure(directory=DATA_DIR, offline=None):
+    """
+    Pins astropy to the bundled tables and stops it from reaching the network.
+
+    With a bundle in directory (see prefetch) its IERS-A table becomes the Earth orientation table and its
+    leap second file the system one; offline without a bundle, the IERS-A copy shipped with astropy is used.
+    Automatic IERS downloads and all astropy downloads are switched off, and times past the end of the
+    tables degrade with a warning instead of an error, so transforms never stall on download attempts or
+    staleness checks. Without a bundle nothing is changed unless offline is set.
+
+    Parameters
+    ----------
+    directory : str
+        Bundle directory.
+    offline : bool, optional
+        Switch the downloads off even without a bundle, falling back to the tables shipped with astropy.
+        Defaults to the PYQUAZA_OFFLINE environment variable.
+
+    Returns
+    -------
+    bool
+        Whether astropy was configured.
+    """
+    if offline is None:
+        offline = os.environ.get('PYQUAZA_OFFLINE', '').lower() in ('1', 'true', 'yes')
+    finals = os.path.join(directory, 'finals2000A.all')
+    leap = os.path.join(directory, 'Leap_Second.dat')
+    if not (offline or os.path.exists(finals)):
+        return False
+
+    iers.conf.auto_download = False
+    iers.conf.iers_degraded_accuracy = 'warn'
+    data_conf.allow_internet = False
+    if os.path.exists(leap):
+        iers.conf.system_leap_second_file = leap
+    if not os.path.exists(finals):
+        # The IERS-A copy shipped with astropy (astropy-iers-data) still beats IERS-B for predictions.
+        finals = getattr(iers, 'IERS_A_FILE', None)
+    if finals is not None and os.path.exists(finals):
+        iers.earth_orientation_table.set(iers.IERS_A.open(finals))
+    return True
+
+def warm_up(lat=0, long=0, start=None, directory=DATA_DIR, offline=None):
+    """
+    Loads the Earth rotation tables, the week's ephemeris and the coordinate transform path ahead of time.
+
+    Call it at service start (pqService serve does) so the first forecast does not pay for table loading,
+    leap second checks, filling the ephemeris store and astropy building its transform graph path and
+    caches; it is then as fast as the ones after it.
+
+    Parameters
+    ----------
+    lat, long : float
+        Location of the trial transform.
+    start : datetime date, optional
+        Day of the forecast week whose ephemeris is filled, defaults to today.
+    directory, offline
+        As in configure.
+
+    Returns
+    -------
+    dict
+        Seconds spent on each step.
+    """
+    timings = {}
+
+    def step(name, action):
+        began = time.perf_counter()
+        with pqInstrument.span(name):
+            action()
+        timings[name] = time.perf_counter() - began
+
+    with pqInstrument.span('warm_up'):
+        step('configure', lambda: configure(directory, offline))
+        step('iers', lambda: (iers.earth_orientation_table.get(), Time.now().ut1))
+        tf = pq.Transformations(lat, long, start)
+        step('ephemeris', lambda: [tf.positions(body) for body in pqEphemeris.BODIES])
+        step('transform', lambda: tf.locate(['sun', 'moon'], np.arange(2)))
+    return timings
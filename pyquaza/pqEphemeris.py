@@ -0,0 +1,214 @@
+import os
+import shutil
+import threading
+import numpy as np
+import pqInstrument
+from collections import OrderedDict
+from datetime import datetime,timedelta,timezone
+from astropy import units as u
+from astropy.time import Time
+from astropy.coordinates import get_body,get_sun,SkyCoord,CartesianRepresentation,GCRS,AltAz,EarthLocation
+
+CACHE_DIR = os.environ.get('PYQUAZA_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.pyquaza'))
+
+BODIES = ['sun','moon','mercury','venus','mars','jupiter','saturn','uranus','neptune']
+
+class EphemerisStore:
+    """
+    On-disk store of geocentric body positions shared by every location and process.
+
+    Geocentric (GCRS) positions only depend on time, so they are computed once per time grid and saved as
+    one .npy file per body holding a (3, N) array of x, y, z in AU. Files are opened memory-mapped, so every
+    process reading the same day shares the page cache instead of holding its own copy. The first request
+    for a time grid fills the positions of every body in BODIES. Only the arrays of the max_grids time grids
+    used most recently are kept open, and prune() removes the files of grids that have ended.
+
+    Parameters
+    ----------
+    directory : str
+        Directory the position files are written to.
+    bodies : list of str
+        Bodies computed when a new time grid is filled.
+    max_grids : int
+        Number of time grids whose arrays are kept open. A week of day-aligned grids (see day_positions) uses
+        one per day plus one for the week, so the default holds the current and the previous week.
+    """
+    def __init__(self, directory=os.path.join(CACHE_DIR, 'ephemeris'), bodies=BODIES, max_grids=16):
+        self.directory = directory
+        self.bodies = list(bodies)
+        self.max_grids = max_grids
+        self._arrays = OrderedDict()
+        self._lock = threading.Lock()
+        self._arrays_lock = threading.Lock()
+
+    def grid_key(self, timeframe):
+        """Returns the name identifying a time grid by its start, span and number of samples."""
+
+        span = (timeframe[-1] - timeframe[0]).to_value(u.s) if len(timeframe) > 1 else 0
+        return f"{timeframe[0].strftime('%Y%m%dT%H%M%S')}_{span:.0f}s_{len(timeframe)}"
+
+    def positions(self, body, timeframe):
+        """
+        Returns the memory-mapped (3, N) geocentric position array of a body over a time grid in AU.
+
+        Parameters
+        ----------
+        body : str
+            Sun, Moon or planet name.
+        timeframe : astropy Time
+            Time grid the positions are sampled on.
+        """
+        body = body.lower()
+        key = (self.grid_key(timeframe), body)
+        xyz = self._cached(key)
+        if xyz is None:
+            path = os.path.join(self.directory, key[0], f"{body}.npy")
+            if not os.path.exists(path):
+                with self._lock:
+                    if not os.path.exists(path):
+                        pqInstrument.count('ephemeris_misses')
+                        with pqInstrument.span('ephemeris_fill'):
+                            self.fill(timeframe, bodies=set(self.bodies) | {body})
+            xyz = np.load(path, mmap_mode='r')
+            self._keep(key, xyz)
+
+        return xyz
+
+    def day_positions(self, body, start, days, per_day):
+        """
+        Returns the (3, days*per_day) geocentric position array of a body over a day-aligned grid in AU.
+        
+        The grid starts at midnight UTC of start and has per_day samples per day without an endpoint, as in
+        pqFrame.time_grid(start, 24*days, days*per_day, endpoint=False). Positions are stored one day per
+        grid, so the grid starting a day later only computes its last day.
+        
+        Parameters
+        ----------
+        body : str
+            Sun, Moon or planet name.
+        start : datetime date
+            Day the grid starts on.
+        days, per_day : int
+            Number of days and samples per day.
+        """
+        body = body.lower()
+        key = (f"{start.isoformat()}_{days}x{per_day}", body)
+        xyz = self._cached(key)
+        if xyz is None:
+            step = np.arange(per_day)*(24/per_day)*u.hour
+            xyz = np.concatenate([self.positions(body, Time(datetime.combine(start+timedelta(days=day), datetime.min.time()))+step)
+                                  for day in range(days)], axis=1)
+            self._keep(key, xyz)
+        
+        return xyz
+    
+    def _cached(self, key):
+        # Array of a (grid, body) key if its grid is still open, marking the grid as the most recently used.
+        with self._arrays_lock:
+            grid = self._arrays.get(key[0])
+            if grid is None:
+                return None
+            self._arrays.move_to_end(key[0])
+            return grid.get(key[1])
+
+    def _keep(self, key, xyz):
+        # Keeps an array open, closing the grids used least recently once more than max_grids are open.
+        with self._arrays_lock:
+            self._arrays.setdefault(key[0], {})[key[1]] = xyz
+            self._arrays.move_to_end(key[0])
+            while len(self._arrays) > self.max_grids:
+                self._arrays.popitem(last=False)
+
+    def prune(self, before=None):
+        """
+        Removes the position files of time grids that end before a time.
+
+        Processes still reading a removed grid keep their memory maps; anything asking for it again refills
+        it. Day-aligned grids (see day_positions) are named by their start, so they go once their day is over.
+
+        Parameters
+        ----------
+        before : datetime, optional
+            Grids ending before this are removed, defaults to midnight UTC today, so everything a forecast
+            starting today can use is kept.
+
+        Returns
+        -------
+        list of str
+            Names of the grids removed.
+        """
+        before = datetime.combine(datetime.now(timezone.utc).date(), datetime.min.time()) if before is None else before
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return []
+        removed = []
+        for name in names:
+            try:
+                begins, span, _ = name.split('_')
+                end = datetime.strptime(begins, '%Y%m%dT%H%M%S') + timedelta(seconds=float(span.rstrip('s')))
+            except ValueError:
+                continue
+            if end < before:
+                shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+                removed.append(name)
+        return removed
+
+    def coordinates(self, body, timeframe, samples=None):
+        """Returns the stored geocentric positions of a body as a GCRS SkyCoord, optionally at sample indices only."""
+
+        xyz = self.positions(body, timeframe)
+        if samples is not None:
+            xyz = xyz[:, samples]
+            timeframe = timeframe[samples]
+        return SkyCoord(CartesianRepresentation(xyz, unit=u.AU, copy=False), frame=GCRS(obstime=timeframe))
+
+    def fill(self, timeframe, bodies=None):
+        """
+        Computes and saves the geocentric positions of bodies over a time grid.
+
+        Files are written under a temporary name and renamed into place, so other processes never
+        memory-map a partially written array.
+        """
+        directory = os.path.join(self.directory, self.grid_key(timeframe))
+        os.makedirs(directory, exist_ok=True)
+        for body in (self.bodies if bodies is None else bodies):
+            path = os.path.join(directory, f"{body}.npy")
+            if os.path.exists(path):
+                continue
+            if body == 'sun':
+                location = get_sun(timeframe)
+            else:
+                location = get_body(body=body, time=timeframe)
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp.npy"
+            np.save(tmp, location.cartesian.xyz.to_value(u.AU))
+            os.replace(tmp, path)
+
+
+class TransientEphemeris:
+    """
+    Ephemeris backend computing body positions in memory at exactly the times asked for, saving nothing.
+
+    Like pqAnalytic.AnalyticEphemeris it has an altaz method, so pqFrame.Transformations asks it for the
+    samples it locates only, instead of having an EphemerisStore fill and save every body in BODIES over the
+    whole time grid. Meant for grids that are used once, such as the windows of pqFrame.stream, whose files
+    would never be read again.
+    """
+    def altaz(self, body, timeframe, lat, long):
+        """Returns the altitude (deg), azimuth (deg) and topocentric distance (AU) of a body at timeframe."""
+
+        body = body.lower()
+        location = get_sun(timeframe) if body == 'sun' else get_body(body=body, time=timeframe)
+        altaz = location.transform_to(AltAz(obstime=timeframe, location=EarthLocation(lat=lat*u.deg, lon=long*u.deg)))
+        return altaz.alt.deg, altaz.az.deg, altaz.distance.to_value(u.AU)
+
+
+_default_store = None
+
+def default_store():
+    """Returns the process-wide EphemerisStore used by pqFrame.Transformations, pruning ended grids on creation."""
+    global _default_store
+    if _default_store is None:
+        _default_store = EphemerisStore()
+        _default_store.prune()
+    return _default_store
@@ -0,0 +1,146 @@
+import atexit
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+EXECUTORS = ('serial', 'thread', 'process')
+
+_pools = {}
+
+def get_pool(executor, workers=None):
+    """
+    Returns a reusable thread or process pool, creating it on first use.
+
+    Pools are kept for the life of the process so worker start-up (and the astropy import in every worker
+    process) is only paid once.
+
+    Parameters
+    ----------
+    executor : str
+        'thread' or 'process'.
+    workers : int, optional
+        Number of workers, defaults to the concurrent.futures default.
+    """
+    key = (executor, workers)
+    if key not in _pools:
+        if executor == 'thread':
+            _pools[key] = ThreadPoolExecutor(max_workers=workers)
+        elif executor == 'process':
+            _pools[key] = ProcessPoolExecutor(max_workers=workers)
+        else:
+            raise ValueError(f"executor must be one of {EXECUTORS}, not {executor!r}")
+    return _pools[key]
+
+def shutdown():
+    """Shuts down every pool created by get_pool."""
+    for pool in _pools.values():
+        pool.shutdown()
+    _pools.clear()
+
+atexit.register(shutdown)
+
+def run_map(fn, tasks, executor='serial', workers=None):
+    """
+    Calls fn(*task) for every task and returns the results in task order.
+
+    Parameters
+    ----------
+    fn : function
+        Module-level function (it has to be picklable for the process executor).
+    tasks : list of tuple
+        Positional arguments of each call.
+    executor : str
+        'serial' runs in the calling thread, 'thread' and 'process' fan out over a pool.
+    workers : int, optional
+        Pool size.
+    """
+    if executor not in EXECUTORS:
+        raise ValueError(f"executor must be one of {EXECUTORS}, not {executor!r}")
+    tasks = list(tasks)
+    if executor == 'serial' or len(tasks) <= 1:
+        return [fn(*task) for task in tasks]
+
+    pool = get_pool(executor, workers)
+    return list(pool.map(fn, *zip(*tasks)))
+
+
+class SharedArrays:
+    """
+    Named numpy arrays that workers fill in place instead of pickling their results back.
+
+    With shared=True every array lives in its own multiprocessing shared memory block, so worker processes
+    attach to it by name. Otherwise the arrays are ordinary numpy arrays handed to threads directly.
+    Use as a context manager; the shared blocks are released on exit, after the results have been copied
+    out with result().
+
+    Parameters
+    ----------
+    specs : dict
+        Array name mapped to (shape, dtype).
+    shared : bool
+        Place the arrays in shared memory (needed for the process executor).
+    fill : float
+        Initial value of every element.
+    """
+    def __init__(self, specs, shared=False, fill=np.nan):
+        self.shared = shared
+        self.blocks = {}
+        self.arrays = {}
+        for name, (shape, dtype) in specs.items():
+            if shared:
+                nbytes = max(int(np.prod(shape))*np.dtype(dtype).itemsize, 1)
+                self.blocks[name] = shared_memory.SharedMemory(create=True, size=nbytes)
+                self.arrays[name] = np.ndarray(shape, dtype=dtype, buffer=self.blocks[name].buf)
+                self.arrays[name][...] = fill
+            else:
+                self.arrays[name] = np.full(shape, fill, dtype=dtype)
+
+    def spec(self):
+        """Returns what a worker passes to attach(): block names when shared, the arrays themselves otherwise."""
+
+        if not self.shared:
+            return self.arrays
+        return {name: (block.name, self.arrays[name].shape, self.arrays[name].dtype.str)
+                for name, block in self.blocks.items()}
+
+    def result(self):
+        """Returns private copies of the arrays."""
+
+        return {name: np.array(array) for name, array in self.arrays.items()}
+
+    def close(self):
+        self.arrays = {}
+        for block in self.blocks.values():
+            block.close()
+            block.unlink()
+        self.blocks = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def attach(spec):
+    """
+    Returns (blocks, arrays) for a SharedArrays spec inside a worker.
+
+    Keep the returned blocks alive while using the arrays and close them afterwards; the parent owns and
+    unlinks the memory.
+    """
+    blocks, arrays = {}, {}
+    for name, value in spec.items():
+        if isinstance(value, np.ndarray):
+            arrays[name] = value
+            continue
+        block_name, shape, dtype = value
+        block = shared_memory.SharedMemory(name=block_name)
+        blocks[name] = block
+        arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+    return blocks, arrays
+
+def detach(blocks):
+    """Closes the blocks returned by attach."""
+    for block in blocks.values():
+        block.close()
@@ -1,19 +1,62 @@
+import threading
 import numpy as np
-import pandas as pd
-import requests
+import pqWeather
+import pqEphemeris
+import pqExecutor
+import pqInstrument
+from collections import OrderedDict
 from datetime import date,datetime
 from astropy import units as u
 from astropy.time import Time
-from astropy.coordinates import get_body,get_sun,get_moon,EarthLocation,AltAz
+from astropy.coordinates import EarthLocation,AltAz,SkyCoord,CartesianRepresentation,GCRS
+
+def time_grid(start, hours=168, n_samples=2016, endpoint=True, window=None):
+    """
+    Returns the (delta_time, timeframe) sample grid starting at midnight UTC of a day.
+    
+    Parameters
+    ----------
+    start : datetime date
+        Day the grid starts on.
+    hours : float
+        Length of the grid in hours.
+    n_samples : int
+        Number of samples, spaced evenly.
+    endpoint : bool
+        Include the end of the grid as the last sample. Without it the samples are spaced hours/n_samples
+        apart, so with whole days of samples the grid of the next day is this grid shifted by one day.
+    window : tuple of int, optional
+        (first, stop) range of sample indices to return instead of the whole grid, with the same values.
+    """
+    if window is None:
+        delta_time = np.linspace(0,hours,n_samples,endpoint=endpoint)*u.hour
+    else:
+        # The values np.linspace gives these samples, without building the rest of the grid.
+        first, stop = window
+        delta_time = np.arange(first, stop)*(hours/(max(n_samples-1, 1) if endpoint else n_samples))
+        if endpoint and stop == n_samples and n_samples > 1:
+            delta_time[-1] = hours
+        delta_time = delta_time*u.hour
+    today = datetime.combine(start, datetime.min.time())
+    time_now = Time(today)
+    
+    return delta_time, Time(time_now)+delta_time
 
 class Transformations:
     """
     Pulls data for celestial body locations in the solar system and transforms those to a reference frame fixed in your backyard.
     
+    The Sun track and every body track are computed once and kept on the instance (the cloud forecast is cached
+    by the WeatherProvider), so a single Transformations object can be shared between forecasts for the same
+    location and start date. Tracks are filled in per sample, so callers can ask for only the samples they need
+    (e.g. the astronomical night found from the Sun track, see night_samples) and pay for nothing else.
+
     Attributes
     ----------
     backyard_frame: Coordinate Frame
         Coordinate frame fixed at user-input defined location in teh Altitude-Azimuth system.
+    start: datetime date
+        Day the forecast week starts on (midnight UTC).
     timeframe: astropy Time
         Time object ranging from the time when run to a week ahead.
     delta_time: numpy Array
@@ -22,21 +65,72 @@ class Transformations:
         DataFrame containing altitude (in degrees) and azimuth (in degrees) for celestial bodies in the solar system in the backyard frame over the following week.
     body_altaz astropy SkyCoord Object
         SkyCoord object containing location of a single user-defined celestial body in the backyard frame over the following week.
+    body_tracks: dict
+        Altitude (deg), azimuth (deg) and distance (AU) arrays over the full timeframe for the Sun and every body
+        located so far, keyed by lower-case body name. Samples not computed yet are flagged False in 'done'.
     sun_altaz SkyCoord Object
         SkyCoord object containing location of the Sun in the backyard frame over the following week.
+    clouds: numpy Array
+        Daily percent cloud coverage forecast, None until check_weather is called.
+    weather: pqWeather WeatherProvider
+        Cached weather source used by check_weather, defaults to pqWeather.default_provider().
+    ephemeris: pqEphemeris EphemerisStore
+        Shared store of geocentric body positions, defaults to pqEphemeris.default_store(). Only the
+        topocentric transform into the backyard frame is done per location. A backend with an altaz method
+        instead (e.g. pqAnalytic.AnalyticEphemeris) computes altitude and azimuth itself, without astropy.
+    sampling: str
+        'dense' evaluates every night sample of the timeframe. 'adaptive' first evaluates every coarse_step-th
+        sample and only refines to the full timeframe resolution near the cost minimum and near twilight,
+        horizon and forecast-day crossings (see adaptive_samples).
+    coarse_step: int
+        Number of timeframe samples between coarse samples in adaptive mode (6 samples = 30 minutes).
+    tolerance: float
+        Coarse samples with cost within tolerance of the coarse minimum are refined in adaptive mode. It must
+        exceed the cost change between any sample and its nearest coarse sample; with cost_fx and 30-minute
+        steps that is at most 15 minutes of altitude change (under 4 deg), i.e. a cost change below 40.
+    endpoint: bool
+        Whether the time grid includes its end (see time_grid). A grid without it and with whole days of
+        samples is day-aligned: geocentric positions are then read from the ephemeris store one day at a
+        time, and tracks can be carried over to the next day's grid (see pqRolling).
+    window: tuple of int
+        (first, stop) range of samples of the full grid this object covers, None for all of them. Sample
+        indices are then relative to first (see offset), while delta_time still counts from the start of the
+        grid. stream() walks a long grid one window at a time.
+    offset: int
+        Index of the first sample in the full grid.
+    visibility: dict
+        pqVisibility.VisibilityIndex of each (body, min_alt, sun_limit) built from the tracks (see
+        VisibilityIndex.cached), emptied whenever locate adds samples to body_tracks.
+    lock: threading RLock
+        Held by callers that share one Transformations between threads (e.g. pqService requests for the same
+        location), since filling in tracks is not thread-safe.
     """
-    def __init__(self, lat, long):
+    def __init__(self, lat, long, start=None, weather=None, ephemeris=None, hours=168, n_samples=2016,
+                 sampling='dense', coarse_step=6, tolerance=40, endpoint=True, window=None):
         self.lat = lat
         self.long = long
-        self.delta_time = np.linspace(0,168,2016)*u.hour
-        today = datetime.combine(date.today(), datetime.min.time())
-        time_now = Time(today)
-        self.timeframe = Time(time_now)+self.delta_time
+        self.start = date.today() if start is None else start
+        self.hours = hours
+        self.n_samples = n_samples
+        self.endpoint = endpoint
+        self.window = window
+        self.offset = 0 if window is None else window[0]
+        self.delta_time, self.timeframe = time_grid(self.start, hours, n_samples, endpoint, window)
         self.backyard = EarthLocation(lat=self.lat*u.deg ,lon=self.long*u.deg)
         self.backyard_frame = AltAz(obstime=self.timeframe, location=self.backyard)
+        self.body_tracks = {}
+        self.sun_altaz = None
+        self.clouds = None
+        self.weather = weather if weather is not None else pqWeather.default_provider()
+        self.ephemeris = ephemeris if ephemeris is not None else pqEphemeris.default_store()
+        self.sampling = sampling
+        self.coarse_step = coarse_step
+        self.tolerance = tolerance
+        self.visibility = {}
+        self.lock = threading.RLock()
         
     
-    def in_my_sky(self, body):
+    def in_my_sky(self, body, samples=None):
         """
         Finds the location of a user-defined celestial body and transforms it into the backyard frame over the next week.
         
@@ -44,31 +138,315 @@ class Transformations:
         ----------
         body : str
             Celestial body in the solar system to locate.
+        samples : numpy Array, optional
+            Indices into timeframe to locate the body at, defaults to the whole week.
         """
         
-        if body.lower() == 'moon':
-            body_location = get_moon(time=self.timeframe, location=self.backyard)
-        else:
-            body_location = get_body(body=body,time=self.timeframe, location=self.backyard)
-
-        self.body_altaz = body_location.transform_to(self.backyard_frame)
+        self.body_altaz = self._track(body.lower(), samples)
 
         return self.body_altaz
     
     
-    def sun_for_me(self):
-        """Finds the location of the Sun and transforms it to the backyard frame over the next week. """
+    def sun_for_me(self, samples=None):
+        """Finds the location of the Sun and transforms it to the backyard frame over the next week (or at the given sample indices). """
         
-        self.sun_altaz  = get_sun(self.timeframe).transform_to(self.backyard_frame)
+        self.sun_altaz = self._track('sun', samples)
         
         return self.sun_altaz
     
-    def check_weather(self):
+    def night_samples(self, margin=0, sun_limit=-18):
+        """
+        Returns the indices of timeframe samples in astronomical night, found from the Sun track alone.
+        
+        Parameters
+        ----------
+        margin : int
+            Number of extra samples kept on each side of every night interval.
+        sun_limit : float
+            Sun altitude (deg) below which the sky counts as dark.
+        """
+        
+        night = self.sun_for_me().alt.deg < sun_limit
+        if margin > 0:
+            night = np.convolve(night, np.ones(2*margin+1), mode='same') > 0
+        
+        return np.flatnonzero(night)
+    
+    def adaptive_samples(self, body, cost, margin=0, sun_limit=-18):
+        """
+        Returns the indices of timeframe samples worth evaluating for a body, found coarse-to-fine.
+        
+        The Sun, body and cost are first evaluated every coarse_step samples. Coarse intervals are refined
+        to every sample when either end is a night sample within tolerance of the lowest night cost, or when
+        the interval crosses twilight (sun_limit), or crosses the horizon or a forecast-day boundary at night.
+        The region around the cost minimum is widened by margin samples. The result may include daytime
+        samples, which are dropped like any others.
+        
+        Parameters
+        ----------
+        body : str
+            Celestial body in the solar system to locate.
+        cost : function
+            Vectorized cost function taking (cloud, alt) arrays.
+        margin : int
+            Number of extra samples kept on each side of every refined interval.
+        sun_limit : float
+            Sun altitude (deg) below which the sky counts as dark.
+        """
+        
+        n = len(self.timeframe)
+        coarse = np.arange(0, n, self.coarse_step)
+        if coarse[-1] != n-1:
+            coarse = np.append(coarse, n-1)
+        
+        self.locate(['sun', body], coarse)
+        night = self.sun_for_me(coarse).alt.deg < sun_limit
+        bodyalt = self.in_my_sky(body, coarse).alt.deg
+        clouds = self.clouds_for(coarse)
+        coarse_cost = np.asarray(cost(clouds, bodyalt), dtype=float)
+        
+        near_best = np.zeros(len(coarse), dtype=bool)
+        if night.any():
+            near_best = night & (coarse_cost <= coarse_cost[night].min() + self.tolerance)
+        
+        # Flag coarse interval j (coarse[j] to coarse[j+1]) for refinement. Horizon and forecast-day
+        # crossings only matter when the interval touches the night.
+        dark = night[:-1] | night[1:]
+        crossing = (np.diff(night) != 0) | (dark & ((np.diff(bodyalt > 0) != 0) | (np.diff(clouds) != 0)))
+        best = near_best[:-1] | near_best[1:]
+        
+        interval = np.clip(np.searchsorted(coarse, np.arange(n), side='right')-1, 0, len(best)-1)
+        keep_best = best[interval]
+        keep_best[coarse[1:][best]] = True
+        # Only the samples around the cost minimum need the extra margin.
+        if margin > 0:
+            keep_best = np.convolve(keep_best, np.ones(2*margin+1), mode='same') > 0
+        keep = keep_best | crossing[interval]
+        keep[coarse[1:][crossing]] = True
+        
+        refined = np.flatnonzero(keep)
+        self.locate(['sun', body], refined)
+        
+        return refined
+    
+    def samples_for(self, body, cost, margin=0):
+        """Returns the sample indices to evaluate a body at for the configured sampling mode."""
+        
+        if self.sampling == 'adaptive':
+            return self.adaptive_samples(body, cost, margin=margin)
+        
+        return self.night_samples(margin=margin)
+    
+    def locate(self, bodies, samples=None, executor='serial', workers=None):
+        """
+        Transforms several bodies into the backyard frame at the sample indices with a single astropy call.
+        
+        Only samples not computed before are transformed; the results are stored in body_tracks. With a
+        thread or process executor each body is transformed by its own worker instead, and the tracks come
+        back through shared memory.
+        
+        Parameters
+        ----------
+        bodies : list of str
+            Bodies to locate ('sun' included).
+        samples : numpy Array, optional
+            Indices into timeframe to locate the bodies at, defaults to the whole week.
+        executor : str
+            'serial', 'thread' or 'process' (see pqExecutor.run_map).
+        workers : int, optional
+            Pool size for the thread and process executors.
+        """
+        
+        n = len(self.timeframe)
+        samples = np.arange(n) if samples is None else np.asarray(samples, dtype=int)
+        keys, missing, cached = [], [], 0
+        for body in bodies:
+            key = body.lower()
+            track = self.body_tracks.get(key)
+            if track is None:
+                track = {'alt': np.full(n, np.nan), 'az': np.full(n, np.nan), 'distance': np.full(n, np.nan),
+                         'done': np.zeros(n, dtype=bool)}
+                self.body_tracks[key] = track
+            todo = np.unique(samples[~track['done'][samples]])
+            cached += samples.size - todo.size
+            if todo.size:
+                keys.append(key)
+                missing.append(todo)
         
-        url = "https://api.openweathermap.org/data/2.5/forecast/daily?lat=" + str(self.lat) + "&lon=" + str(self.long) + "&cnt=7&appid=ece9f5354fef610b3f4ac8e96a6a4895&units=imperial"
-        response = requests.request("GET", url)
-        results = response.json()
-        df_weather = pd.DataFrame(results["list"])
-        clouds = df_weather['clouds'].to_numpy()
+        pqInstrument.count('samples_cached', cached)
+        if not keys:
+            return
         
-        return clouds
\ No newline at end of file
+        with pqInstrument.span('locate', bodies=keys):
+            pqInstrument.count('samples_located', sum(todo.size for todo in missing))
+            self._locate(keys, missing, executor, workers)
+    
+    def _locate(self, keys, missing, executor, workers):
+        """Transforms the missing samples of each body and stores them in body_tracks."""
+        
+        if hasattr(self.ephemeris, 'altaz'):
+            # Analytic backends are cheap enough that fanning out would only add overhead.
+            alt, az, distance = np.concatenate([self.ephemeris.altaz(key, self.timeframe[todo], self.lat, self.long)
+                                                for key, todo in zip(keys, missing)], axis=1)
+        elif executor == 'serial' or len(keys) == 1:
+            with pqInstrument.span('ephemeris'):
+                xyz = np.concatenate([self.positions(key)[:, todo]
+                                      for key, todo in zip(keys, missing)], axis=1)
+            with pqInstrument.span('transform'):
+                obstime = self.timeframe[np.concatenate(missing)]
+                location = SkyCoord(CartesianRepresentation(xyz, unit=u.AU, copy=False), frame=GCRS(obstime=obstime))
+                altaz = location.transform_to(AltAz(obstime=obstime, location=self.backyard))
+                alt, az, distance = altaz.alt.deg, altaz.az.deg, altaz.distance.to_value(u.AU)
+        else:
+            # Fill the shared ephemeris files once here rather than in every worker.
+            for key in keys:
+                self.positions(key)
+            offsets = np.cumsum([0]+[todo.size for todo in missing])
+            with pqExecutor.SharedArrays({'track': ((3, offsets[-1]), float)}, shared=executor == 'process') as out:
+                tasks = [(self.lat, self.long, self.start, self.hours, self.n_samples, self.endpoint, self.window,
+                          self.ephemeris.directory, key, todo, out.spec(), offset)
+                         for key, todo, offset in zip(keys, missing, offsets)]
+                pqExecutor.run_map(_locate_worker, tasks, executor, workers)
+                alt, az, distance = out.result()['track']
+        
+        start = 0
+        for key, todo in zip(keys, missing):
+            track, stop = self.body_tracks[key], start+todo.size
+            track['alt'][todo] = alt[start:stop]
+            track['az'][todo] = az[start:stop]
+            track['distance'][todo] = distance[start:stop]
+            track['done'][todo] = True
+            start = stop
+        self.visibility.clear()
+    
+    def positions(self, body):
+        """Returns the (3, N) geocentric position array of a body over timeframe in AU from the ephemeris store."""
+        
+        days = self.hours/24
+        if self.window is None and not self.endpoint and days == int(days) and self.n_samples % days == 0:
+            return self.ephemeris.day_positions(body, self.start, int(days), self.n_samples//int(days))
+        
+        return self.ephemeris.positions(body, self.timeframe)
+    
+    def _track(self, key, samples):
+        """Returns a body's AltAz SkyCoord at the sample indices, transforming only samples not computed before."""
+        
+        samples = np.arange(len(self.timeframe)) if samples is None else np.asarray(samples, dtype=int)
+        self.locate([key], samples)
+        track = self.body_tracks[key]
+        
+        return SkyCoord(alt=track['alt'][samples]*u.deg, az=track['az'][samples]*u.deg,
+                        distance=track['distance'][samples]*u.AU, frame='altaz',
+                        obstime=self.timeframe[samples], location=self.backyard)
+    
+    def clouds_for(self, samples=None):
+        """
+        Returns the percent cloud coverage forecast for the day each sample index falls on.
+
+        Samples past the last forecast day (only possible with more than a week of hours) get the coverage of
+        the last day; see forecast_days.
+        """
+        
+        clouds = self.check_weather()
+        samples = slice(None) if samples is None else samples
+        day = (self.delta_time[samples].to_value(u.hour)//24).astype(int)
+        
+        return clouds[np.clip(day, 0, len(clouds)-1)]
+    
+    def forecast_days(self):
+        """Returns the number of days from the start of the grid the cloud forecast covers."""
+
+        return len(self.check_weather())
+
+    def check_weather(self):
+        """
+        Pulls the daily percent cloud coverage forecast for the backyard.
+
+        The lookup goes through the WeatherProvider cache, so it only reaches the weather service when the
+        cached forecast has expired.
+        """
+
+        self.clouds = self.weather.clouds(self.lat, self.long)
+
+        return self.clouds
+
+
+def _locate_worker(lat, long, start, hours, n_samples, endpoint, window, ephemeris_dir, key, samples, out, offset):
+    """Locates one body in a worker and writes its altitude, azimuth and distance into the shared track array."""
+    
+    tf = Transformations(lat, long, start, hours=hours, n_samples=n_samples, endpoint=endpoint, window=window,
+                         ephemeris=pqEphemeris.EphemerisStore(ephemeris_dir))
+    tf.locate([key], samples)
+    track = tf.body_tracks[key]
+    blocks, arrays = pqExecutor.attach(out)
+    arrays['track'][:, offset:offset+samples.size] = [track['alt'][samples], track['az'][samples],
+                                                      track['distance'][samples]]
+    del arrays
+    pqExecutor.detach(blocks)
+
+
+def stream(lat, long, start=None, hours=168, n_samples=2016, chunk=2016, **options):
+    """
+    Yields Transformations covering consecutive windows of chunk samples of a time grid, in time order.
+
+    Only one window is held at a time once the previous one is released, so memory is bounded by chunk no
+    matter how long or finely sampled the grid is. Sample indices of each window are relative to its offset.
+    Every window has its own time grid, so by default bodies are located with a pqEphemeris.TransientEphemeris
+    at the samples asked for only, and nothing is written to the ephemeris store. The weather forecast only
+    covers its first days; later samples reuse the cloud coverage of its last day (see clouds_for).
+
+    Parameters
+    ----------
+    lat : float
+        Latitude of the viewing location in degrees.
+    long : float
+        Longitude of the viewing location in degrees.
+    start : datetime date, optional
+        Day the grid starts on, defaults to today.
+    hours, n_samples : float, int
+        Length and number of samples of the whole grid (see time_grid).
+    chunk : int
+        Number of samples per window.
+    options
+        Any other Transformations options (weather, ephemeris, endpoint, ...).
+    """
+    start = date.today() if start is None else start
+    ephemeris = options.pop('ephemeris', None)
+    ephemeris = pqEphemeris.TransientEphemeris() if ephemeris is None else ephemeris
+    for first in range(0, n_samples, chunk):
+        yield Transformations(lat, long, start, hours=hours, n_samples=n_samples, ephemeris=ephemeris,
+                              window=(first, min(first+chunk, n_samples)), **options)
+
+
+_sessions = OrderedDict()
+_sessions_lock = threading.Lock()
+max_sessions = 16
+
+def sky_session(lat, long, start=None, **options):
+    """
+    Returns the shared Transformations object for a location and start date, creating it on first use.
+
+    Sessions are keyed by (lat, long, start date) and any extra Transformations options (e.g. sampling), and
+    the least recently used ones are dropped once more than max_sessions are held.
+
+    Parameters
+    ----------
+    lat : float
+        Latitude of the viewing location in degrees.
+    long : float
+        Longitude of the viewing location in degrees.
+    start : datetime date, optional
+        Day the forecast week starts on, defaults to today.
+    """
+    key = (lat, long, date.today() if start is None else start, tuple(sorted(options.items())))
+    with _sessions_lock:
+        tf = _sessions.get(key)
+        pqInstrument.count('session_misses' if tf is None else 'session_hits')
+        if tf is None:
+            tf = Transformations(lat, long, start=key[2], **options)
+            _sessions[key] = tf
+        _sessions.move_to_end(key)
+        while len(_sessions) > max_sessions:
+            _sessions.popitem(last=False)
+
+    return tf
@@ -1,6 +1,164 @@
+import time
+from datetime import date
 from PyQt5 import QtCore, QtGui, QtWidgets
-import pqBodyForecast as bf
-import pqWeeklyForecast as wf
+
+#The forecast modules pull in astropy, pandas, matplotlib and requests, so they are only imported by the worker
+#thread (see ForecastWorker.preload) and the window paints without waiting for them
+
+#Status bar text shown before each forecasting stage
+STAGE_TEXT = {'locate': "Locating bodies...",
+              'body_this_week': "Locating body...",
+              'set_body_df': "Collecting cloud coverage...",
+              'cut_daytime': "Removing daytime...",
+              'best_time': "Finding best time...",
+              'best_body': "Finding best time...",
+              'plot_onebody': "Drawing plot..."}
+
+#Decoded images by (file, width, height, aspect mode), so switching bodies back and forth decodes each one once
+_pixmaps = {}
+
+def loadPixmap(file, size, aspect=QtCore.Qt.IgnoreAspectRatio):
+    """
+    Decodes an image file straight at the size it is displayed at, never larger than the file itself.
+    
+    Large assets are scaled while decoding rather than decoded at full size and scaled by the label on every
+    paint. aspect is how the image fits size (e.g. QtCore.Qt.KeepAspectRatio for labels that are not scaled).
+    """
+    key = (file, size.width(), size.height(), aspect)
+    pixmap = _pixmaps.get(key)
+    if pixmap is None:
+        reader = QtGui.QImageReader(file)
+        full = reader.size()
+        if full.isValid() and (full.width() > size.width() or full.height() > size.height()):
+            reader.setScaledSize(full.scaled(size, aspect))
+        pixmap = QtGui.QPixmap.fromImage(reader.read())
+        _pixmaps[key] = pixmap
+    return pixmap
+
+class Cancelled(Exception):
+    """Raised inside the worker when a newer request replaces the running one."""
+
+
+class ForecastWorker(QtCore.QThread):
+    """
+    Runs forecasts off the Qt main thread so the window stays responsive.
+    
+    Requests run one at a time and only the newest one waiting is kept: submitting a request while another is
+    running makes the running one stop at its next stage. Every signal carries the generation number of its
+    request so the window can ignore results from requests it has since replaced.
+    
+    The forecast modules are imported by this thread on its first request, or ahead of it by preload(), which
+    also loads the Earth rotation tables, the week's ephemeris and the plot template (see pqData.warm_up).
+    
+    Signals: progress (generation, status text), partial (generation, forecast text shown before the plot),
+             done (generation, forecast text, plot QImage), failed (generation, error message),
+             ready (seconds the preload took)
+    """
+    progress = QtCore.pyqtSignal(int, str)
+    partial = QtCore.pyqtSignal(int, str)
+    done = QtCore.pyqtSignal(int, str, QtGui.QImage)
+    failed = QtCore.pyqtSignal(int, str)
+    ready = QtCore.pyqtSignal(float)
+    
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._mutex = QtCore.QMutex()
+        self._wake = QtCore.QWaitCondition()
+        self._pending = None
+        self._preload = False
+        self._stopping = False
+    
+    def preload(self):
+        #Import and warm up the forecast modules while no request is waiting
+        self._mutex.lock()
+        self._preload = True
+        self._wake.wakeOne()
+        self._mutex.unlock()
+    
+    def submit(self, generation, lat, lon, body=None):
+        #Queue a forecast, replacing any request still waiting. body=None runs the general forecast
+        self._mutex.lock()
+        self._pending = (generation, lat, lon, body)
+        self._wake.wakeOne()
+        self._mutex.unlock()
+    
+    def cancel(self):
+        #Stop the running request at its next stage without starting a new one
+        self.submit(None, None, None)
+    
+    def stop(self):
+        #Cancel any running request and end the thread
+        self._mutex.lock()
+        self._stopping = True
+        self._wake.wakeOne()
+        self._mutex.unlock()
+        self.wait()
+    
+    def run(self):
+        while True:
+            self._mutex.lock()
+            while self._pending is None and not self._preload and not self._stopping:
+                self._wake.wait(self._mutex)
+            request, self._pending = self._pending, None
+            preload, self._preload = self._preload and request is None, False
+            stopping = self._stopping
+            self._mutex.unlock()
+            if stopping:
+                return
+            if preload:
+                began = time.perf_counter()
+                try:
+                    self.warmUp()
+                except Exception as error:
+                    self.failed.emit(0, f"Preload failed: {error}")
+                    continue
+                self.ready.emit(time.perf_counter() - began)
+                continue
+            if request[0] is None:
+                continue
+            try:
+                self.forecast(*request)
+            except Cancelled:
+                pass
+            except Exception as error:
+                self.failed.emit(request[0], str(error))
+    
+    def warmUp(self):
+        #Import the scientific stack and fill the caches the first forecast would otherwise wait for
+        import pqData
+        import pqBodyForecast as bf
+        import pqWeeklyForecast
+        pqData.warm_up()
+        bf.plot_template()
+    
+    def forecast(self, generation, lat, lon, body):
+        #Run one request, reporting every stage and the best time as soon as it is known
+        import pqBodyForecast as bf
+        import pqWeeklyForecast as wf
+        prefix = []
+        
+        def report(stage, forecast):
+            if self._pending is not None or self._stopping:
+                raise Cancelled()
+            if stage == 'best_body':
+                prefix.append(f"Best Body: \n{forecast.best_body.capitalize()} \n\n")
+                self.partial.emit(generation, prefix[0])
+            elif stage == 'plot_onebody':
+                self.partial.emit(generation, "".join(prefix) + forecast.best_text())
+            self.progress.emit(generation, STAGE_TEXT.get(stage, f"Checking {stage.capitalize()}..."))
+        
+        #Plots are rendered in memory at the size of the forecast widget rather than saved to body.png
+        self.progress.emit(generation, "Fetching weather...")
+        if body is None:
+            forecast = wf.WeeklyForecast(lat, lon, image_file=None)
+            forecast.get_plot(report)
+        else:
+            forecast = bf.BodyForecast(lat, lon, body, image_file=None)
+            forecast.run_all(report)
+        height, width = forecast.image.shape[:2]
+        image = QtGui.QImage(forecast.image.data, width, height, 4*width, QtGui.QImage.Format_RGBA8888).copy()
+        self.done.emit(generation, "".join(prefix) + forecast.figText, image)
+
 
 class Ui_MainWindow(object):
     """
@@ -46,8 +204,8 @@ class Ui_MainWindow(object):
         self.forecastImage = QtWidgets.QLabel(self.centralwidget)
         self.forecastImage.setGeometry(QtCore.QRect(450, 190, 780, 650))
         self.forecastImage.setText("")
-        self.forecastImage.setPixmap(QtGui.QPixmap("forecastImage.png")) #Setup initial image to be displayed when GUI is first opened
         self.forecastImage.setScaledContents(True)
+        self.forecastImage.setPixmap(loadPixmap("forecastImage.png", self.forecastImage.size())) #Setup initial image to be displayed when GUI is first opened
         self.forecastImage.setObjectName("forecastImage")
         self.forecastImage.setStyleSheet("border: 1px solid black;")
         
@@ -55,7 +213,7 @@ class Ui_MainWindow(object):
         self.pyquazaLogo = QtWidgets.QLabel(self.centralwidget)
         self.pyquazaLogo.setGeometry(QtCore.QRect(20, 10, 471, 171))
         self.pyquazaLogo.setText("")
-        self.pyquazaLogo.setPixmap(QtGui.QPixmap("pyquazaLogo.png"))
+        self.pyquazaLogo.setPixmap(loadPixmap("pyquazaLogo.png", self.pyquazaLogo.size(), QtCore.Qt.KeepAspectRatio))
         self.pyquazaLogo.setObjectName("pyquazaLogo")
         
         #Setup location for PyQuaza/GUI functionality overview 
@@ -111,8 +269,8 @@ class Ui_MainWindow(object):
         self.specificBodyLogo = QtWidgets.QLabel(self.centralwidget)
         self.specificBodyLogo.setGeometry(QtCore.QRect(30, 450, 181, 181))
         self.specificBodyLogo.setText("")
-        self.specificBodyLogo.setPixmap(QtGui.QPixmap("moon.png"))
         self.specificBodyLogo.setScaledContents(True)
+        self.specificBodyLogo.setPixmap(loadPixmap("moon.png", self.specificBodyLogo.size()))
         self.specificBodyLogo.setObjectName("specificBodyLogo")
         
         #Define menu and status bars for GUI
@@ -131,12 +289,24 @@ class Ui_MainWindow(object):
         self.specificBodyButton.clicked.connect(self.showSpecificBody)
         self.comboBox.currentTextChanged.connect(self.showSpecificBodyImage)
         self.generalForecastButton.clicked.connect(self.showGeneralForecast)
+        
+        #Run forecasts in a background thread. generation counts requests so results of replaced ones are dropped,
+        #and requestKey remembers the inputs of the request running or shown so repeat clicks are ignored
+        self.generation = 0
+        self.requestKey = None
+        self.worker = ForecastWorker()
+        self.worker.progress.connect(self.showProgress)
+        self.worker.partial.connect(self.showPartialForecast)
+        self.worker.done.connect(self.showForecast)
+        self.worker.failed.connect(self.showForecastError)
+        self.worker.ready.connect(self.showReady)
+        self.worker.start()
 
     def showSpecificBodyImage(self):
         #Function to show a sample image of the user-selected planet, linked to combobox selection
         body = self.comboBox.currentText() #Pull user-selected body choice
         bodyLogoFile = f"{body}.png" #Establish file name (predetermined)
-        self.specificBodyLogo.setPixmap(QtGui.QPixmap(bodyLogoFile))
+        self.specificBodyLogo.setPixmap(loadPixmap(bodyLogoFile, self.specificBodyLogo.size()))
     
     def showSpecificBody(self):
         #Function to feed user inputs (latitude, longitude, body) into pqBodyForecast module
@@ -147,24 +317,61 @@ class Ui_MainWindow(object):
         body = self.comboBox.currentText() #Pull user-selected body choice           
               
         if body == 'Earth': 
+            self.generation += 1 #Drop whatever forecast is still running
+            self.requestKey = ('Earth',)
+            self.worker.cancel()
+            self.statusbar.clearMessage()
             self.forecastOutputText.setText(_translate("MainWindow", "Maybe just look down?"))
-            self.forecastImage.setPixmap(QtGui.QPixmap("outputIfEarth.png"))
+            self.forecastImage.setPixmap(loadPixmap("outputIfEarth.png", self.forecastImage.size()))
         else:     
-            bodyForecast = bf.BodyForecast(lat, lon, body)
-            bodyForecast.run_all()
-            self.forecastOutputText.setText(_translate("MainWindow", bodyForecast.figText))
-            self.forecastImage.setPixmap(QtGui.QPixmap("body.png"))
+            self.requestForecast(lat, lon, body)
         
     def showGeneralForecast(self):
         #Function to feed user inputs (latitude, longitude) into pqWeeklyForecast module
         #Outputs image and text corresponding to optimal body choice and viewing time from pqWeeklyForecast into GUI widgets
-        _translate = QtCore.QCoreApplication.translate
         lat = self.latEntry.value() #Pull user-entered latitude entry
         lon = self.lonEntry.value() #Pull user-entered longitude entry
-        genForecast = wf.WeeklyForecast(lat,lon)
-        genForecast.get_plot()
-        self.forecastOutputText.setText(_translate("MainWindow", genForecast.figText))
-        self.forecastImage.setPixmap(QtGui.QPixmap("body.png"))
+        self.requestForecast(lat, lon)
+    
+    def requestForecast(self, lat, lon, body=None):
+        #Hand a forecast to the worker thread, unless the same one is already running or shown. The date is part
+        #of the key, so after midnight the same inputs forecast the new week
+        key = (lat, lon, body, date.today())
+        if key == self.requestKey:
+            return
+        self.generation += 1
+        self.requestKey = key
+        self.worker.submit(self.generation, lat, lon, body)
+    
+    def showProgress(self, generation, text):
+        #Show the stage the current forecast is at in the status bar
+        if generation == self.generation:
+            self.statusbar.showMessage(text)
+    
+    def showPartialForecast(self, generation, text):
+        #Show the best body and time while the plot is still being drawn
+        if generation == self.generation:
+            _translate = QtCore.QCoreApplication.translate
+            self.forecastOutputText.setText(_translate("MainWindow", text))
+    
+    def showForecast(self, generation, text, image):
+        #Show the finished forecast text and plot
+        if generation == self.generation:
+            _translate = QtCore.QCoreApplication.translate
+            self.statusbar.clearMessage()
+            self.forecastOutputText.setText(_translate("MainWindow", text))
+            self.forecastImage.setPixmap(QtGui.QPixmap.fromImage(image))
+    
+    def showReady(self, seconds):
+        #Note in the status bar that forecasts no longer wait for imports, unless one is already reporting
+        if not self.statusbar.currentMessage():
+            self.statusbar.showMessage(f"Ready (forecast modules loaded in {seconds:.1f} s)", 5000)
+    
+    def showForecastError(self, generation, message):
+        #Report a failed forecast and allow the same inputs to be tried again
+        if generation == self.generation:
+            self.requestKey = None
+            self.statusbar.showMessage(f"Forecast failed: {message}")
 
 ##################################################
 
@@ -204,4 +411,6 @@ if __name__ == "__main__":
     ui = Ui_MainWindow()
     ui.setupUi(MainWindow)
     MainWindow.show()
+    QtCore.QTimer.singleShot(0, ui.worker.preload) #Preload once the event loop has painted the window
+    app.aboutToQuit.connect(ui.worker.stop)
     app.exec_()
\ No newline at end of file
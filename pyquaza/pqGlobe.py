@@ -0,0 +1,154 @@
+import os
+import json
+import threading
+import numpy as np
+from numpy.lib.format import open_memmap
+from datetime import date
+
+CACHE_DIR = os.environ.get('PYQUAZA_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.pyquaza'))
+
+FIELDS = {'sample': np.int16, 'alt': np.float32, 'az': np.float32, 'distance': np.float32, 'peak': np.float32}
+
+class GlobeGrid:
+    """
+    On-disk store of precomputed forecasts for every integer latitude and longitude, one week at a time.
+
+    For each site, body and forecast day the grid holds the dark sample with the lowest altitude part of the
+    cost (see pqSites.build_globe) and the body's altitude, azimuth and distance there, plus the highest
+    altitude the body reaches in that day's dark samples. Cloud coverage is constant over a forecast day, so
+    for a cost whose cloud term does not depend on altitude (like pqBodyForecast.cost_fx) the best time of
+    the week is one of these per-day samples, and best() finds it from the live cloud forecast with a few
+    array reads. Each field is a .npy file shaped (lat, long, body, day) and opened memory-mapped, so a
+    lookup only touches the pages of one site. Sites are filled tile by tile and flagged in 'done', so a
+    build can be resumed or limited to a region.
+
+    Parameters
+    ----------
+    directory : str
+        Directory holding meta.json and the field files of one week.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.start = date.fromisoformat(self.meta['start'])
+        self.bodies = self.meta['bodies']
+        self.hours = self.meta['hours']
+        self.n_samples = self.meta['n_samples']
+        self.sun_limit = self.meta['sun_limit']
+        self.mode = 'r'
+        self._arrays = {}
+
+    @classmethod
+    def create(cls, directory, start, bodies, hours=168, n_samples=2016, sun_limit=-18):
+        """Creates an empty grid for the week starting on start, or opens the one already there for writing."""
+
+        if not os.path.exists(os.path.join(directory, 'meta.json')):
+            os.makedirs(directory, exist_ok=True)
+            n_days = int(hours//24) + 1
+            shape = (181, 361, len(bodies), n_days)
+            for name, dtype in FIELDS.items():
+                array = open_memmap(os.path.join(directory, f"{name}.npy"), mode='w+', dtype=dtype, shape=shape)
+                array[:] = -1 if name == 'sample' else np.nan
+                array.flush()
+            open_memmap(os.path.join(directory, 'done.npy'), mode='w+', dtype=bool, shape=shape[:2]).flush()
+            meta = {'start': start.isoformat(), 'bodies': list(bodies), 'hours': hours, 'n_samples': n_samples,
+                    'sun_limit': sun_limit}
+            tmp = os.path.join(directory, f"meta.json.{os.getpid()}.tmp")
+            with open(tmp, 'w') as f:
+                json.dump(meta, f)
+            os.replace(tmp, os.path.join(directory, 'meta.json'))
+
+        grid = cls(directory)
+        grid.mode = 'r+'
+        return grid
+
+    def array(self, name):
+        """Returns the memory-mapped field array name ('done' or one of FIELDS)."""
+
+        array = self._arrays.get(name)
+        if array is None:
+            array = np.load(os.path.join(self.directory, f"{name}.npy"), mmap_mode=self.mode)
+            self._arrays[name] = array
+        return array
+
+    def site(self, lat, long):
+        """Returns the (lat, long) array index of a site, or None if it is not on the grid or not built yet."""
+
+        if lat != int(lat) or long != int(long) or not (-90 <= lat <= 90 and -180 <= long <= 180):
+            return None
+        index = (int(lat) + 90, int(long) + 180)
+        return index if self.array('done')[index] else None
+
+    def matches(self, tf):
+        """Returns whether a pqFrame.Transformations uses the time grid the forecasts were made on."""
+
+        return (tf.start == self.start and tf.hours == self.hours and tf.n_samples == self.n_samples
+                and tf.endpoint and self.site(tf.lat, tf.long) is not None)
+
+    def best(self, lat, long, body, clouds, cost):
+        """
+        Looks up the best time of the week to observe a body from a site.
+
+        Parameters
+        ----------
+        lat, long : int
+            Site on the grid.
+        body : str
+            One of bodies.
+        clouds : numpy Array
+            Daily percent cloud coverage forecast, as from Transformations.check_weather.
+        cost : function
+            Vectorized cost(cloud, alt) function whose cloud term does not depend on altitude.
+
+        Returns
+        -------
+        dict or None
+            sample (index into the timeframe), day, cost, alt, az, distance and peak (highest altitude of the
+            body that night) of the best time, or None when the site is not on the grid or the body has no
+            dark samples this week.
+        """
+        index = self.site(lat, long)
+        body = body.lower()
+        if index is None or body not in self.bodies:
+            return None
+        record = {name: self.array(name)[index][self.bodies.index(body)] for name in FIELDS}
+        days = np.flatnonzero(record['sample'] >= 0)
+        if days.size == 0:
+            return None
+
+        clouds = np.asarray(clouds, dtype=float)[np.clip(days, 0, len(clouds)-1)]
+        day_cost = np.asarray(cost(clouds, record['alt'][days].astype(float)), dtype=float)
+        i = int(np.argmin(day_cost))
+        day = days[i]
+        return {'sample': int(record['sample'][day]), 'day': int(day), 'cost': float(day_cost[i]),
+                **{name: float(record[name][day]) for name in ('alt', 'az', 'distance', 'peak')}}
+
+    def write(self, rows, cols, fields):
+        """Stores the fields of a tile of sites, given as (site, body, day) arrays, and marks them done."""
+
+        for name, values in fields.items():
+            array = self.array(name)
+            array[rows, cols] = values.astype(array.dtype)
+            array.flush()
+        done = self.array('done')
+        done[rows, cols] = True
+        done.flush()
+
+
+_grids = {}
+_grids_lock = threading.Lock()
+
+def default_grid(start=None):
+    """
+    Returns the grid for the week starting on start (today by default) under CACHE_DIR/globe, or None if no
+    grid has been built for it.
+    """
+    start = date.today() if start is None else start
+    directory = os.path.join(CACHE_DIR, 'globe', start.isoformat())
+    with _grids_lock:
+        grid = _grids.get(directory)
+        if grid is None and os.path.exists(os.path.join(directory, 'meta.json')):
+            grid = GlobeGrid(directory)
+            _grids[directory] = grid
+    return grid
@@ -0,0 +1,121 @@
+import time
+import cProfile
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+
+_active = ContextVar('pyquaza_timer', default=None)
+_disabled = nullcontext()
+
+class Timer:
+    """
+    Collects named timing spans and counters from a forecast run.
+
+    Activate a Timer around a run (BodyForecast.run_all and WeeklyForecast.get_plot take one as timer=) and
+    every span() and count() reached inside is recorded against it. Spans nest, so a span's path names the
+    stage, body and step it belongs to, e.g. 'get_plot/milkyway_this_week/venus/locate'. Without an active
+    Timer span() and count() do nothing, so the instrumentation costs close to nothing when disabled.
+
+    Parameters
+    ----------
+    callback : function, optional
+        Called with each finished span record (see report) as soon as the span closes.
+    profile : str, optional
+        File to dump cProfile statistics of the whole activation to (read with pstats).
+    """
+    def __init__(self, callback=None, profile=None):
+        self.callback = callback
+        self.profile = profile
+        self.spans = []
+        self.counts = {}
+        self._stack = []
+        self._origin = None
+        self._profiler = None
+
+    @contextmanager
+    def span(self, name, **info):
+        """Times the enclosed block as a span named name, with any extra info stored on its record."""
+
+        record = {'name': name, 'path': '/'.join([frame['name'] for frame in self._stack]+[name]),
+                  'depth': len(self._stack), 'start': time.perf_counter()-self._origin, 'seconds': None,
+                  'counts': {}, **info}
+        self._stack.append(record)
+        began = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['seconds'] = time.perf_counter()-began
+            self._stack.pop()
+            self.spans.append(record)
+            if self.callback is not None:
+                self.callback(record)
+
+    def count(self, name, value=1):
+        """Adds value to a counter, both on the innermost open span and in the run totals."""
+
+        self.counts[name] = self.counts.get(name, 0) + value
+        if self._stack:
+            counts = self._stack[-1]['counts']
+            counts[name] = counts.get(name, 0) + value
+
+    def report(self):
+        """
+        Returns the structured timing report.
+
+        Returns
+        -------
+        dict
+            'spans': span records in the order they started, each with name, path, depth, start and seconds
+            (relative to activation) and the counts recorded directly inside it, and 'counts': run totals.
+        """
+        return {'spans': sorted(self.spans, key=lambda record: record['start']), 'counts': dict(self.counts)}
+
+    def format(self):
+        """Returns the report as an indented text table."""
+
+        lines = [f"{'span':<48} {'seconds':>9}  counts"]
+        for record in self.report()['spans']:
+            counts = ', '.join(f"{name}={value}" for name, value in record['counts'].items())
+            lines.append(f"{'  '*record['depth'] + record['name']:<48} {record['seconds']:9.4f}  {counts}")
+        return '\n'.join(lines)
+
+
+@contextmanager
+def activate(timer):
+    """
+    Makes timer the active Timer of the enclosed block, a no-op for None or a timer that is already active.
+
+    When the timer has a profile file, cProfile runs for the block and its statistics are dumped there.
+    """
+    if timer is None or _active.get() is timer:
+        yield timer
+        return
+
+    token = _active.set(timer)
+    if timer._origin is None:
+        timer._origin = time.perf_counter()
+    if timer.profile is not None:
+        timer._profiler = cProfile.Profile()
+        timer._profiler.enable()
+    try:
+        yield timer
+    finally:
+        if timer._profiler is not None:
+            timer._profiler.disable()
+            timer._profiler.dump_stats(timer.profile)
+            timer._profiler = None
+        _active.reset(token)
+
+def span(name, **info):
+    """Returns a span context on the active Timer, or a shared do-nothing context when none is active."""
+
+    timer = _active.get()
+    if timer is None:
+        return _disabled
+    return timer.span(name, **info)
+
+def count(name, value=1):
+    """Adds value to a counter of the active Timer, if any."""
+
+    timer = _active.get()
+    if timer is not None:
+        timer.count(name, value)
@@ -0,0 +1,169 @@
+import os
+import threading
+import numpy as np
+import pqFrame as pq
+import pqBodyForecast as bf
+import pqWeeklyForecast as wf
+import pqEphemeris
+from datetime import date
+
+class RollingWeek:
+    """
+    Persisted rolling forecast week for one location, recomputing only the days it has not seen.
+
+    The Sun and body tracks of a day-aligned Transformations (endpoint=False, so sample i of tomorrow's week is
+    sample i + per_day of today's) are saved to disk. When the date advances, the tracks are shifted by whole
+    days, the expired days are dropped, and only the samples of the new days are transformed. The geocentric
+    positions behind them come from the ephemeris store one day at a time, so they are only computed for the
+    new days as well. Cloud coverage is kept as its own per-sample column and is replaced on its own when the
+    weather forecast changes, without touching the tracks.
+
+    The Transformations returned by advance and update can be passed as tf to BodyForecast and WeeklyForecast.
+
+    Parameters
+    ----------
+    lat, long : float
+        Latitude and longitude of the viewing location in degrees.
+    bodies : list of str
+        Bodies kept up to date by update, the Sun is always included.
+    directory : str
+        Directory the rolling weeks are saved to, one file per location.
+    days, per_day : int
+        Length of the week in days and samples per day (288 samples = 5 minutes).
+    weather : pqWeather WeatherProvider, optional
+        Weather source, defaults to pqWeather.default_provider().
+    ephemeris : pqEphemeris EphemerisStore, optional
+        Store of geocentric body positions, defaults to pqEphemeris.default_store().
+    """
+    def __init__(self, lat, long, bodies=wf.BODY_SET, directory=os.path.join(pqEphemeris.CACHE_DIR, 'rolling'),
+                 days=7, per_day=288, weather=None, ephemeris=None):
+        self.lat = lat
+        self.long = long
+        self.bodies = list(bodies)
+        self.directory = directory
+        self.days = days
+        self.per_day = per_day
+        self.weather = weather
+        self.ephemeris = ephemeris
+        self.tf = None
+        self.clouds = None
+        self.computed = 0
+        self._lock = threading.Lock()
+
+    @property
+    def path(self):
+        return os.path.join(self.directory, f"{self.lat:+.4f}_{self.long:+.4f}_{self.days}x{self.per_day}.npz")
+
+    def advance(self, today=None):
+        """
+        Returns the Transformations for the week starting today, carrying over every sample already computed.
+
+        Parameters
+        ----------
+        today : datetime date, optional
+            Day the week starts on, defaults to today.
+        """
+        today = date.today() if today is None else today
+        with self._lock:
+            if self.tf is not None and self.tf.start == today:
+                return self.tf
+
+            if self.tf is not None:
+                start, tracks, clouds = self.tf.start, self.tf.body_tracks, self.clouds
+            else:
+                start, tracks, clouds = self._load()
+
+            self.tf = pq.Transformations(self.lat, self.long, today, weather=self.weather, ephemeris=self.ephemeris,
+                                         hours=24*self.days, n_samples=self.days*self.per_day, endpoint=False)
+            self.clouds = None
+            if start is not None:
+                shift = (today - start).days*self.per_day
+                self.tf.body_tracks = {key: {name: _shift(values, shift) for name, values in track.items()}
+                                       for key, track in tracks.items()}
+                if shift == 0:
+                    self.clouds = clouds
+
+            return self.tf
+
+    def update(self, today=None):
+        """
+        Advances to today, fills in the Sun and body tracks, refreshes the cloud column and saves the week.
+
+        Returns the Transformations of the week. The number of samples transformed is kept in self.computed.
+        """
+        tf = self.advance(today)
+        before = sum(int(track['done'].sum()) for track in tf.body_tracks.values())
+        tf.locate(['sun']+self.bodies)
+        self.computed = sum(int(track['done'].sum()) for track in tf.body_tracks.values()) - before
+        self.refresh_clouds()
+        self.save()
+
+        return tf
+
+    def refresh_clouds(self):
+        """Re-reads the cloud forecast into the per-sample cloud column. Returns True if the column changed."""
+
+        clouds = self.tf.clouds_for()
+        if self.clouds is not None and np.array_equal(clouds, self.clouds):
+            return False
+        self.clouds = clouds
+        return True
+
+    def best_samples(self, cost=bf.cost_fx, sun_limit=-18):
+        """
+        Returns the night sample of lowest cost for every body from the stored tracks and cloud column.
+
+        Only the cost is evaluated, so after refresh_clouds reports a change this is all that needs to run
+        again. Bodies never dark at the location map to -1. It first advances to today (keeping a week that
+        already starts today), locates any samples the tracks are missing and reads an empty cloud column.
+        """
+        tf = self.advance()
+        tf.locate(['sun']+self.bodies)
+        if self.clouds is None:
+            self.refresh_clouds()
+        night = tf.body_tracks['sun']['alt'] < sun_limit
+        best = {}
+        for body in self.bodies:
+            sample_cost = np.where(night, cost(self.clouds, tf.body_tracks[body]['alt']), np.inf)
+            best[body] = int(np.argmin(sample_cost)) if night.any() else -1
+
+        return best
+
+    def save(self):
+        """Writes the tracks and cloud column to disk, replacing the previous file atomically."""
+
+        arrays = {'start': np.array(self.tf.start.isoformat())}
+        for key, track in self.tf.body_tracks.items():
+            for name, values in track.items():
+                arrays[f"{key}:{name}"] = values
+        if self.clouds is not None:
+            arrays['clouds'] = self.clouds
+
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp.npz"
+        np.savez(tmp, **arrays)
+        os.replace(tmp, self.path)
+
+    def _load(self):
+        try:
+            with np.load(self.path) as data:
+                start = date.fromisoformat(str(data['start']))
+                tracks = {}
+                for name in data.files:
+                    if ':' in name:
+                        key, field = name.split(':')
+                        tracks.setdefault(key, {})[field] = data[name]
+                clouds = data['clouds'] if 'clouds' in data.files else None
+        except (OSError, ValueError, KeyError):
+            return None, {}, None
+
+        return start, tracks, clouds
+
+
+def _shift(values, shift):
+    """Moves a track shift samples earlier, filling the samples it frees at the end as not computed."""
+
+    shifted = np.zeros_like(values) if values.dtype == bool else np.full_like(values, np.nan)
+    if 0 <= shift < len(values):
+        shifted[:len(values)-shift] = values[shift:]
+    return shifted
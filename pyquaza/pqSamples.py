@@ -0,0 +1,139 @@
+import numpy as np
+import pandas as pd
+
+class SampleBlock:
+    """
+    Compact columnar store of forecast samples for one or more bodies.
+
+    All bodies share one time axis: indices into the timeframe of a pqFrame.Transformations, which is
+    referenced rather than copied. Per-sample columns (hours since the start, Sun altitude, cloud coverage)
+    are 1-D and per-body columns (altitude, azimuth, distance) are (body, sample) blocks, all float32.
+    Calendar fields are only decoded for the samples asked for through row(); to_dataframe converts the block
+    to the DataFrame layout used in notebooks.
+
+    Attributes
+    ----------
+    bodies : list of str
+        Body names, one per row of the per-body columns.
+    samples : numpy Array
+        Sample indices into timeframe.
+    timeframe : astropy Time
+        Full time grid the samples index into.
+    deltahrs, sunalt, clouds : numpy Array
+        Hours since the start of the timeframe, Sun altitude (deg) and percent cloud coverage per sample.
+    alt, az, distance : numpy Array
+        Altitude (deg), azimuth (deg) and distance (AU) shaped (body, sample). NaN where a body was not
+        evaluated.
+    """
+    def __init__(self, bodies, samples, timeframe, deltahrs, sunalt, clouds, alt, az, distance):
+        self.bodies = list(bodies)
+        self.samples = samples
+        self.timeframe = timeframe
+        self.deltahrs = deltahrs
+        self.sunalt = sunalt
+        self.clouds = clouds
+        self.alt = alt
+        self.az = az
+        self.distance = distance
+
+    @classmethod
+    def from_transformations(cls, tf, bodies, samples, evaluated=None):
+        """
+        Builds a block from the tracks a Transformations has already computed at the sample indices.
+
+        Parameters
+        ----------
+        tf : pqFrame.Transformations
+            Source of the time grid, Sun and body tracks and cloud forecast.
+        bodies : list of str
+            Bodies to include, each located at the samples beforehand (see Transformations.locate).
+        samples : numpy Array
+            Sorted sample indices forming the shared time axis.
+        evaluated : list of numpy Array, optional
+            Samples each body was evaluated at. The body's columns are NaN at the other samples.
+        """
+        samples = np.asarray(samples, dtype=np.int32)
+        columns = {name: np.empty((len(bodies), samples.size), dtype=np.float32) for name in ('alt', 'az', 'distance')}
+        for i, body in enumerate(bodies):
+            track = tf.body_tracks[body.lower()]
+            for name, values in columns.items():
+                values[i] = track[name][samples]
+            if evaluated is not None:
+                outside = ~np.isin(samples, evaluated[i])
+                for values in columns.values():
+                    values[i, outside] = np.nan
+
+        return cls(bodies, samples, tf.timeframe,
+                   tf.delta_time[samples].to_value('hour').astype(np.float32),
+                   tf.body_tracks['sun']['alt'][samples].astype(np.float32),
+                   tf.clouds_for(samples).astype(np.float32), **columns)
+
+    def __len__(self):
+        return self.samples.size
+
+    def select(self, mask):
+        """Returns a block with only the samples where mask (or the given positions) selects."""
+
+        return SampleBlock(self.bodies, self.samples[mask], self.timeframe, self.deltahrs[mask], self.sunalt[mask],
+                           self.clouds[mask], self.alt[:, mask], self.az[:, mask], self.distance[:, mask])
+
+    def night(self, sun_limit=-18):
+        """Returns the samples where the Sun is below sun_limit (deg)."""
+
+        return self.select(self.sunalt < sun_limit)
+
+    def day(self):
+        """Returns the forecast day (0 for the first) each sample falls on."""
+
+        return (self.deltahrs//24).astype(int)
+
+    def cost(self, cost):
+        """Evaluates a vectorized cost(cloud, alt) function, returning (body, sample) costs with inf where not evaluated."""
+
+        values = np.asarray(cost(self.clouds.astype(float), self.alt.astype(float)), dtype=float)
+        return np.where(np.isnan(values), np.inf, values)
+
+    def datetimes(self):
+        """Returns the sample times as numpy datetime64 truncated to the minute."""
+
+        return self.timeframe[self.samples].datetime64.astype('datetime64[m]')
+
+    def row(self, body, i):
+        """
+        Returns one sample of one body as a pandas Series with its calendar fields decoded.
+
+        Parameters
+        ----------
+        body : int
+            Row of the body in bodies.
+        i : int
+            Position of the sample in this block.
+        """
+        ymdhms = self.timeframe[self.samples[i]].ymdhms
+        return pd.Series({'day': ymdhms.day, 'month': ymdhms.month, 'year': ymdhms.year, 'hour': ymdhms.hour,
+                          'minute': ymdhms.minute, 'deltahrs': self.deltahrs[i], 'sunalt': self.sunalt[i],
+                          'bodyalt': self.alt[body, i], 'bodyaz': self.az[body, i],
+                          'bodydist': self.distance[body, i], 'clouds': self.clouds[i],
+                          'body': self.bodies[body]}, name=int(self.samples[i]))
+
+    def to_dataframe(self, body=None):
+        """
+        Converts the block to a pandas DataFrame indexed by sample.
+
+        With body (a name or row) only that body's columns are included, otherwise every body is stacked with
+        a body column.
+        """
+        rows = range(len(self.bodies)) if body is None else \
+            [self.bodies.index(body) if isinstance(body, str) else body]
+        ymdhms = self.timeframe[self.samples].ymdhms
+        frames = []
+        for b in rows:
+            frame = pd.DataFrame({'day': ymdhms.day, 'month': ymdhms.month, 'year': ymdhms.year,
+                                  'hour': ymdhms.hour, 'minute': ymdhms.minute, 'deltahrs': self.deltahrs,
+                                  'sunalt': self.sunalt, 'bodyalt': self.alt[b], 'bodyaz': self.az[b],
+                                  'bodydist': self.distance[b], 'clouds': self.clouds}, index=self.samples)
+            if body is None:
+                frame['body'] = self.bodies[b]
+            frames.append(frame)
+
+        return pd.concat(frames) if len(frames) > 1 else frames[0]
@@ -0,0 +1,271 @@
+"""
+Headless forecasts for scripts and other programs: a command line entry point and a small local HTTP/JSON service.
+
+    python pqService.py forecast 24 -85 --body jupiter
+    python pqService.py batch sites.csv --executor thread --workers 4
+    python pqService.py serve --port 8765
+    python pqService.py build-globe --executor process
+    python pqService.py prefetch-data
+
+The service answers GET /forecast?lat=24&long=-85[&body=jupiter][&image=1] with the JSON of forecast(). Nothing
+here imports Qt. Everything runs in one process, so the Transformations sessions (see pqFrame.sky_session), the
+ephemeris store and the weather provider's pooled HTTP session stay warm between requests. Every command
+pins astropy to the Earth rotation tables bundled by prefetch-data when they exist (see pqData.configure), and
+serve warms them up before taking requests.
+"""
+import pqFrame as pq
+import pqBodyForecast as bf
+import pqWeeklyForecast as wf
+import pqExecutor
+import pqSites
+import pqData
+import argparse
+import base64
+import io
+import json
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from matplotlib import image as mpimg
+
+# Threads the plots are drawn on. Each keeps its own warm PlotTemplate (see pqBodyForecast.plot_template),
+# rather than every short-lived request thread building one.
+RENDER_THREADS = 2
+
+_render_pool = None
+_render_pool_lock = threading.Lock()
+
+def forecast(lat, long, body=None, start=None, image=False, sampling='dense'):
+    """
+    Finds the best time to observe a body this week, or the best body when none is given, as a JSON-ready dict.
+
+    Requests for the same location and start date share one pqFrame.sky_session and take turns on its lock;
+    other locations run concurrently. The plot is only drawn when image is set, on one of the RENDER_THREADS
+    plot threads (see render).
+
+    Parameters
+    ----------
+    lat : float
+        Latitude of the viewing location in degrees.
+    long : float
+        Longitude of the viewing location in degrees.
+    body : str, optional
+        Body to forecast, defaults to the best body of the week (see WeeklyForecast).
+    start : datetime date, optional
+        Day the forecast week starts on, defaults to today.
+    image : bool
+        Include the plot as a base64 encoded PNG at BodyForecast.display_size.
+    sampling : str
+        'dense' or 'adaptive' (see pqFrame.Transformations).
+
+    Returns
+    -------
+    dict
+        lat, long, body, weekly (whether the body was picked by WeeklyForecast), visible, time (UTC, ISO 8601
+        to the minute), clouds (%), altitude and azimuth (deg), distance (AU), text (the text shown next to the
+        plot, empty when the body cannot be seen) and, with image set, image.
+    """
+    tf = pq.sky_session(lat, long, start, sampling=sampling)
+    weekly = body is None
+    with tf.lock:
+        if weekly:
+            body = wf.WeeklyForecast(lat, long, tf=tf, image_file=None).milkyway_this_week()
+        forecast = bf.BodyForecast(lat, long, body.lower(), tf=tf, image_file=None)
+        for stage in ['body_this_week', 'set_body_df', 'cut_daytime', 'best_time']:
+            getattr(forecast, stage)()
+
+    best = forecast.best_time_val
+    visible = forecast.is_visible()
+    result = {'lat': lat, 'long': long, 'body': forecast.body, 'weekly': weekly, 'visible': visible,
+              'time': str(tf.timeframe[best.name].datetime64.astype('datetime64[m]')) + 'Z',
+              'clouds': int(best.clouds), 'altitude': round(float(best.bodyalt), 2),
+              'azimuth': round(float(best.bodyaz), 2), 'distance': float(best.bodydist),
+              'text': forecast.best_text() if visible else ''}
+    if image:
+        # The plot only reads the forecast's own samples, so it is drawn outside the session lock.
+        result['image'] = base64.b64encode(png(render(forecast))).decode('ascii')
+
+    return result
+
+def render(forecast):
+    """Draws a BodyForecast's plot in memory on a plot thread and returns its RGBA image array."""
+
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is None:
+            _render_pool = ThreadPoolExecutor(max_workers=RENDER_THREADS, thread_name_prefix='pyquaza-render')
+    return _render_pool.submit(_render, forecast).result()
+
+def _render(forecast):
+    forecast.plot_onebody()
+    return forecast.image
+
+def png(rgba):
+    """Encodes an RGBA image array (e.g. BodyForecast.image) as PNG bytes."""
+
+    buffer = io.BytesIO()
+    mpimg.imsave(buffer, rgba, format='png')
+    return buffer.getvalue()
+
+def _batch_task(lat, long, body, start, image, sampling):
+    # Reports a failed site in its output line instead of stopping the batch.
+    try:
+        return forecast(lat, long, body, start, image, sampling)
+    except Exception as err:
+        return {'lat': lat, 'long': long, 'body': body, 'error': str(err)}
+
+def batch(sites, body=None, start=None, image=False, sampling='dense', executor='serial', workers=None):
+    """
+    Runs forecast for every (lat, long) or (lat, long, body) in sites, returning the results in order.
+
+    A site that fails gets a dict with an error message instead. executor and workers are passed to
+    pqExecutor.run_map; 'thread' shares the warm sessions, 'process' gives every worker its own.
+    """
+    tasks = [(site[0], site[1], site[2] if len(site) > 2 and site[2] else body, start, image, sampling)
+             for site in sites]
+    return pqExecutor.run_map(_batch_task, tasks, executor, workers)
+
+def read_sites(lines):
+    """Parses 'lat,long[,body]' lines, skipping blank lines and # comments."""
+
+    sites = []
+    for line in lines:
+        line = line.split('#')[0].strip()
+        if line:
+            fields = [field.strip() for field in line.split(',')]
+            sites.append((float(fields[0]), float(fields[1])) + tuple(fields[2:3]))
+    return sites
+
+
+class ForecastHandler(BaseHTTPRequestHandler):
+    """
+    Serves GET /forecast with the query parameters lat, long (or lon), body, start (YYYY-MM-DD), image and
+    sampling, answering with the JSON of forecast(), or {"error": ...} with status 400, 404 or 500.
+    """
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != '/forecast':
+            return self._send(404, {'error': f"unknown path {url.path}, use /forecast"})
+        try:
+            options = self._options(parse_qs(url.query))
+        except (KeyError, ValueError) as err:
+            return self._send(400, {'error': f"bad query: {err}"})
+        try:
+            result = forecast(**options)
+        except Exception as err:
+            self.log_error("forecast failed: %r", err)
+            return self._send(500, {'error': str(err)})
+        self._send(200, result)
+
+    @staticmethod
+    def _options(query):
+        def get(name, default=None):
+            return query[name][-1] if name in query else default
+
+        long = get('long', get('lon'))
+        if long is None:
+            raise KeyError('long')
+        options = {'lat': float(query['lat'][-1]), 'long': float(long), 'body': get('body'),
+                   'image': get('image', '0').lower() in ('1', 'true', 'yes'), 'sampling': get('sampling', 'dense')}
+        if not -90 <= options['lat'] <= 90:
+            raise ValueError("lat must be within -90 and 90")
+        if not -180 <= options['long'] <= 180:
+            raise ValueError("long must be within -180 and 180")
+        if options['body'] is not None and options['body'].lower() not in wf.BODY_SET:
+            raise ValueError(f"body must be one of {wf.BODY_SET}")
+        if options['sampling'] not in ('dense', 'adaptive'):
+            raise ValueError("sampling must be 'dense' or 'adaptive'")
+        if get('start') is not None:
+            options['start'] = date.fromisoformat(get('start'))
+        return options
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve(host='127.0.0.1', port=8765):
+    """Serves forecasts over HTTP until interrupted, one thread per request."""
+
+    pqData.warm_up()
+    server = ThreadingHTTPServer((host, port), ForecastHandler)
+    server.daemon_threads = True
+    print(f"Serving forecasts on http://{host}:{server.server_port}/forecast", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if _render_pool is not None:
+            _render_pool.shutdown()
+        pqExecutor.shutdown()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    options = argparse.ArgumentParser(add_help=False)
+    options.add_argument('--body', choices=wf.BODY_SET, help='body to forecast, defaults to the best of the week')
+    options.add_argument('--start', type=date.fromisoformat, help='first day of the week (YYYY-MM-DD)')
+    options.add_argument('--image', action='store_true', help='include the plot as a base64 PNG')
+    options.add_argument('--sampling', choices=['dense', 'adaptive'], default='dense')
+
+    single = commands.add_parser('forecast', parents=[options], help='forecast one location')
+    single.add_argument('lat', type=float)
+    single.add_argument('long', type=float)
+
+    many = commands.add_parser('batch', parents=[options], help="forecast every 'lat,long[,body]' line of a file "
+                               "(- for stdin), printing one JSON object per line")
+    many.add_argument('sites', type=argparse.FileType('r'))
+    many.add_argument('--executor', choices=pqExecutor.EXECUTORS, default='serial')
+    many.add_argument('--workers', type=int)
+
+    server = commands.add_parser('serve', help='serve forecasts over HTTP')
+    server.add_argument('--host', default='127.0.0.1')
+    server.add_argument('--port', type=int, default=8765)
+
+    globe = commands.add_parser('build-globe', help="precompute the week's forecasts of every integer site "
+                                "(see pqSites.build_globe), e.g. nightly")
+    globe.add_argument('--start', type=date.fromisoformat, help='first day of the week (YYYY-MM-DD)')
+    globe.add_argument('--directory', help='grid directory, defaults to the cache directory')
+    globe.add_argument('--lats', type=int, nargs=2, default=(-90, 90), metavar=('FROM', 'TO'))
+    globe.add_argument('--longs', type=int, nargs=2, default=(-180, 180), metavar=('FROM', 'TO'))
+    globe.add_argument('--executor', choices=pqExecutor.EXECUTORS, default='serial')
+    globe.add_argument('--workers', type=int)
+
+    data = commands.add_parser('prefetch-data', help='download the Earth rotation tables for offline use '
+                               '(see pqData.prefetch)')
+    data.add_argument('--directory', default=pqData.DATA_DIR)
+
+    args = parser.parse_args(argv)
+    if args.command == 'prefetch-data':
+        print(json.dumps(pqData.prefetch(args.directory), indent=1))
+        return
+    pqData.configure()
+    if args.command == 'serve':
+        serve(args.host, args.port)
+    elif args.command == 'build-globe':
+        grid = pqSites.build_globe(args.start, args.directory, lats=range(args.lats[0], args.lats[1]+1),
+                                   longs=range(args.longs[0], args.longs[1]+1), executor=args.executor,
+                                   workers=args.workers)
+        print(f"{int(grid.array('done').sum())} sites in {grid.directory}", file=sys.stderr)
+        pqExecutor.shutdown()
+    elif args.command == 'forecast':
+        print(json.dumps(forecast(args.lat, args.long, args.body, args.start, args.image, args.sampling), indent=2))
+    else:
+        with args.sites:
+            sites = read_sites(args.sites)
+        for result in batch(sites, args.body, args.start, args.image, args.sampling, args.executor, args.workers):
+            print(json.dumps(result))
+        pqExecutor.shutdown()
+
+if __name__ == '__main__':
+    main()
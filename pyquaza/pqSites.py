@@ -0,0 +1,267 @@
+import os
+import numpy as np
+import pandas as pd
+import pqFrame as pq
+import pqBodyForecast as bf
+import pqWeeklyForecast as wf
+import pqWeather
+import pqEphemeris
+import pqExecutor
+import pqGlobe
+from datetime import date
+from astropy import units as u
+from astropy.coordinates import EarthLocation,AltAz,SkyCoord,CartesianRepresentation,GCRS
+
+def site_tracks(lats, longs, bodies, timeframe, ephemeris=None, samples=None):
+    """
+    Transforms several bodies into the AltAz frames of several sites with one broadcast astropy call.
+
+    Parameters
+    ----------
+    lats, longs : numpy Array
+        Site latitudes and longitudes in degrees, one entry per site.
+    bodies : list of str
+        Bodies to locate ('sun' included).
+    timeframe : astropy Time
+        Full time grid of the forecast.
+    ephemeris : pqEphemeris EphemerisStore, optional
+        Store of geocentric body positions, defaults to pqEphemeris.default_store().
+    samples : numpy Array, optional
+        Indices into timeframe to evaluate, defaults to all of them.
+
+    Returns
+    -------
+    alt, az, distance : numpy Array
+        Altitude (deg), azimuth (deg) and distance (AU), each shaped (body, site, sample).
+    """
+    ephemeris = ephemeris if ephemeris is not None else pqEphemeris.default_store()
+    samples = np.arange(len(timeframe)) if samples is None else samples
+    obstime = timeframe[samples]
+    sites = EarthLocation(lat=np.asarray(lats)*u.deg, lon=np.asarray(longs)*u.deg)
+
+    xyz = np.stack([ephemeris.positions(body, timeframe)[:, samples] for body in bodies], axis=1)
+    location = SkyCoord(CartesianRepresentation(xyz[:, :, np.newaxis, :], unit=u.AU), frame=GCRS(obstime=obstime))
+    altaz = location.transform_to(AltAz(obstime=obstime, location=sites[:, np.newaxis]))
+
+    return altaz.alt.deg, altaz.az.deg, altaz.distance.to_value(u.AU)
+
+def forecast_sites(lats, longs, bodies=wf.BODY_SET, start=None, cost=bf.cost_fx, clouds=None,
+                   weather=None, ephemeris=None, chunk=64, hours=168, n_samples=2016, sun_limit=-18,
+                   executor='serial', workers=None):
+    """
+    Finds the best viewing time of every body at every site, evaluating all sites and bodies together.
+
+    Sites are processed in chunks of `chunk`. For each chunk the Sun is located first at every site, then
+    all bodies are located in one broadcast transform at the samples that are dark at any of the chunk's
+    sites. The best time per site and body is the first night sample of minimum cost, the same rule as
+    BodyForecast.best_time, so the answers match the per-site classes.
+
+    Parameters
+    ----------
+    lats, longs : array_like
+        Site latitudes and longitudes in degrees.
+    bodies : list of str
+        Bodies to forecast.
+    start : datetime date, optional
+        Day the forecast week starts on, defaults to today.
+    cost : function
+        Vectorized cost function taking (cloud, alt) arrays.
+    clouds : numpy Array, optional
+        Daily percent cloud coverage shaped (site, day). Fetched concurrently from the weather provider if omitted
+        (see WeatherProvider.bulk_clouds).
+    weather : pqWeather WeatherProvider, optional
+        Weather source used when clouds is omitted, defaults to pqWeather.default_provider().
+    ephemeris : pqEphemeris EphemerisStore, optional
+        Store of geocentric body positions, defaults to pqEphemeris.default_store().
+    chunk : int
+        Number of sites transformed together. Chunks are the unit of work handed to the executor.
+    hours, n_samples : float, int
+        Length and number of samples of the time grid, as in pq.Transformations.
+    sun_limit : float
+        Sun altitude (deg) below which the sky counts as dark.
+    executor : str
+        'serial', 'thread' or 'process' (see pqExecutor.run_map). Workers write their chunk's results into
+        shared arrays, so the table is the same whatever executor runs it.
+    workers : int, optional
+        Pool size for the thread and process executors.
+
+    Returns
+    -------
+    pandas DataFrame
+        One row per (site, body) with the site index, lat, long, body, best sample index, best time (UTC),
+        altitude, azimuth, distance, cloud coverage and cost. Sites with no dark sample get sample -1.
+    """
+    lats, longs = np.broadcast_arrays(np.atleast_1d(np.asarray(lats, dtype=float)),
+                                      np.atleast_1d(np.asarray(longs, dtype=float)))
+    start = date.today() if start is None else start
+    delta_time, timeframe = pq.time_grid(start, hours, n_samples)
+    if clouds is None:
+        weather = weather if weather is not None else pqWeather.default_provider()
+        clouds = weather.bulk_clouds(lats, longs)
+    clouds = np.asarray(clouds, dtype=float)
+
+    ephemeris = ephemeris if ephemeris is not None else pqEphemeris.default_store()
+    # Fill the shared ephemeris files once here rather than in every worker.
+    for body in ['sun']+list(bodies):
+        ephemeris.positions(body, timeframe)
+
+    n_sites, n_bodies = len(lats), len(bodies)
+    specs = {name: ((n_bodies, n_sites), float) for name in ['sample','alt','az','distance','clouds','cost']}
+    with pqExecutor.SharedArrays(specs, shared=executor == 'process') as out:
+        tasks = [(lats[lo:lo+chunk], longs[lo:lo+chunk], list(bodies), start, hours, n_samples, ephemeris.directory,
+                  cost, clouds[lo:lo+chunk], sun_limit, out.spec(), lo) for lo in range(0, n_sites, chunk)]
+        pqExecutor.run_map(_forecast_chunk, tasks, executor, workers)
+        fields = out.result()
+
+    best = np.where(np.isnan(fields['sample']), -1, fields['sample']).astype(int)
+
+    times = np.full(best.shape, None, dtype=object)
+    times[best >= 0] = timeframe[best[best >= 0]].to_datetime()
+
+    return pd.DataFrame({'site': np.tile(np.arange(n_sites), n_bodies),
+                         'lat': np.tile(lats, n_bodies),
+                         'long': np.tile(longs, n_bodies),
+                         'body': np.repeat(bodies, n_sites),
+                         'sample': best.ravel(),
+                         'time': times.ravel(),
+                         'bodyalt': fields['alt'].ravel(),
+                         'bodyaz': fields['az'].ravel(),
+                         'bodydist': fields['distance'].ravel(),
+                         'clouds': fields['clouds'].ravel(),
+                         'cost': fields['cost'].ravel()})
+
+def _forecast_chunk(lats, longs, bodies, start, hours, n_samples, ephemeris_dir, cost, clouds, sun_limit, out, lo):
+    """Forecasts one chunk of sites and writes the best sample of every body into the output arrays."""
+
+    delta_time, timeframe = pq.time_grid(start, hours, n_samples)
+    ephemeris = pqEphemeris.EphemerisStore(ephemeris_dir)
+    day = np.clip((delta_time.to_value(u.hour)//24).astype(int), 0, clouds.shape[1]-1)
+
+    sunalt = site_tracks(lats, longs, ['sun'], timeframe, ephemeris)[0][0]
+    night = sunalt < sun_limit
+    dark = np.flatnonzero(night.any(axis=0))
+    if dark.size == 0:
+        return
+
+    alt, az, distance = site_tracks(lats, longs, bodies, timeframe, ephemeris, dark)
+    site_clouds = clouds[:, day[dark]]
+    sample_cost = np.where(night[:, dark], cost(site_clouds, alt), np.inf)
+
+    i_best = np.argmin(sample_cost, axis=-1)
+    b, s = np.indices(i_best.shape)
+    found = np.broadcast_to(night[:, dark].any(axis=1), i_best.shape)
+    results = {'sample': dark[i_best], 'alt': alt[b, s, i_best], 'az': az[b, s, i_best],
+               'distance': distance[b, s, i_best], 'clouds': site_clouds[s, i_best], 'cost': sample_cost[b, s, i_best]}
+
+    blocks, arrays = pqExecutor.attach(out)
+    for name, values in results.items():
+        arrays[name][:, lo:lo+len(lats)] = np.where(found, values, np.nan)
+    del arrays
+    pqExecutor.detach(blocks)
+
+def build_globe(start=None, directory=None, bodies=wf.BODY_SET, lats=range(-90, 91), longs=range(-180, 181),
+                tile=10, ephemeris=None, chunk=64, hours=168, n_samples=2016, sun_limit=-18,
+                executor='serial', workers=None):
+    """
+    Precomputes the pqGlobe.GlobeGrid of a week for integer sites, e.g. as a nightly job.
+
+    For every site, body and forecast day the dark sample with the lowest cost_fx altitude term is found with
+    the same broadcast transforms as forecast_sites. BodyForecast and WeeklyForecast then look the best time
+    up from the grid with the live cloud forecast instead of transforming the week. Sites are computed in
+    tiles of tile x tile degrees, each stored as soon as it is done, and tiles already in the grid are
+    skipped, so an interrupted build resumes where it stopped.
+
+    Parameters
+    ----------
+    start : datetime date, optional
+        Day the forecast week starts on, defaults to today.
+    directory : str, optional
+        Grid directory, defaults to the one pqGlobe.default_grid looks in.
+    lats, longs : iterable of int
+        Latitudes and longitudes to build, defaults to the whole globe.
+    tile : int
+        Tile size in degrees.
+    chunk, executor, workers, ephemeris, hours, n_samples, sun_limit
+        As in forecast_sites.
+
+    Returns
+    -------
+    pqGlobe.GlobeGrid
+        The grid, open for writing.
+    """
+    start = date.today() if start is None else start
+    directory = directory if directory is not None else os.path.join(pqGlobe.CACHE_DIR, 'globe', start.isoformat())
+    grid = pqGlobe.GlobeGrid.create(directory, start, bodies, hours, n_samples, sun_limit)
+    n_days = grid.array('sample').shape[-1]
+
+    delta_time, timeframe = pq.time_grid(start, hours, n_samples)
+    ephemeris = ephemeris if ephemeris is not None else pqEphemeris.default_store()
+    for body in ['sun']+list(bodies):
+        ephemeris.positions(body, timeframe)
+
+    lats, longs = np.asarray(list(lats), dtype=int), np.asarray(list(longs), dtype=int)
+    for lat_tile in np.array_split(lats, max(1, int(np.ceil(lats.size/tile)))):
+        for long_tile in np.array_split(longs, max(1, int(np.ceil(longs.size/tile)))):
+            rows, cols = np.ix_(lat_tile + 90, long_tile + 180)
+            if grid.array('done')[rows, cols].all():
+                continue
+            site_lats, site_longs = [values.ravel() for values in np.meshgrid(lat_tile, long_tile, indexing='ij')]
+            n_sites = site_lats.size
+
+            specs = {name: ((n_sites, len(bodies), n_days), float) for name in pqGlobe.FIELDS}
+            with pqExecutor.SharedArrays(specs, shared=executor == 'process') as out:
+                tasks = [(site_lats[lo:lo+chunk], site_longs[lo:lo+chunk], list(bodies), start, hours, n_samples,
+                          ephemeris.directory, sun_limit, out.spec(), lo) for lo in range(0, n_sites, chunk)]
+                pqExecutor.run_map(_globe_chunk, tasks, executor, workers)
+                fields = out.result()
+
+            fields['sample'] = np.where(np.isnan(fields['sample']), -1, fields['sample'])
+            shape = (lat_tile.size, long_tile.size, len(bodies), n_days)
+            grid.write(rows, cols, {name: values.reshape(shape) for name, values in fields.items()})
+
+    return grid
+
+def _globe_chunk(lats, longs, bodies, start, hours, n_samples, ephemeris_dir, sun_limit, out, lo):
+    """Finds the best dark sample of every body on every forecast day for one chunk of sites."""
+
+    delta_time, timeframe = pq.time_grid(start, hours, n_samples)
+    ephemeris = pqEphemeris.EphemerisStore(ephemeris_dir)
+
+    # Night and altitudes go through float32 as in pqSamples.SampleBlock, so the costs match the live forecast.
+    sunalt = site_tracks(lats, longs, ['sun'], timeframe, ephemeris)[0][0].astype(np.float32)
+    night = sunalt < sun_limit
+    dark = np.flatnonzero(night.any(axis=0))
+    if dark.size == 0:
+        return
+
+    alt, az, distance = [values.astype(np.float32) for values in site_tracks(lats, longs, bodies, timeframe, ephemeris, dark)]
+    day = (delta_time[dark].to_value(u.hour).astype(np.float32)//24).astype(int)
+    sample_cost = np.where(night[:, dark], bf.cost_fx(0, alt.astype(float)), np.inf)
+
+    blocks, arrays = pqExecutor.attach(out)
+    for d in np.unique(day):
+        day_cost = np.where(day == d, sample_cost, np.inf)
+        i_best = np.argmin(day_cost, axis=-1)[..., np.newaxis]
+        found = np.isfinite(np.take_along_axis(day_cost, i_best, axis=-1))[..., 0]
+        results = {'sample': dark[i_best[..., 0]]}
+        for name, values in [('alt', alt), ('az', az), ('distance', distance)]:
+            results[name] = np.take_along_axis(values, i_best, axis=-1)[..., 0]
+        results['peak'] = np.where(np.isfinite(day_cost), alt, -np.inf).max(axis=-1)
+        for name, values in results.items():
+            arrays[name][lo:lo+len(lats), :, d] = np.where(found, values, np.nan).T
+    del arrays
+    pqExecutor.detach(blocks)
+
+def best_bodies(results):
+    """
+    Picks the best body per site from a forecast_sites table with the distance reward of WeeklyForecast.
+
+    Returns
+    -------
+    pandas Series
+        Best body name indexed by site.
+    """
+    visible = results[results['sample'] >= 0].copy()
+    visible['reward'] = wf.distance_reward(visible['body'], visible['bodydist'])
+
+    return visible.loc[visible.groupby('site', sort=True)['reward'].idxmax()].set_index('site')['body']
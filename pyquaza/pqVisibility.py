@@ -0,0 +1,185 @@
+import numpy as np
+from astropy.time import Time
+
+class VisibilityIndex:
+    """
+    Sorted list of the windows in which a body can be observed from one location: the Sun below sun_limit and
+    the body above min_alt.
+
+    Windows are found once from the altitude tracks of a pqFrame.Transformations. Their edges are solved by
+    linear root-finding between the samples on either side of the dusk/dawn or rise/set crossing, and the
+    highest point of each window by a parabola through the samples around its maximum, or at an edge when
+    the body rises or sets throughout the window. Windows never overlap, so their starts and ends are both
+    sorted and every query is a binary search over them. Times are hours since the start of the timeframe;
+    queries also accept astropy Time. cached() keeps the index of each body on its Transformations, so it is
+    only built again when more of the tracks are located.
+
+    Attributes
+    ----------
+    body : str
+        Body the windows are for.
+    origin : astropy Time
+        Start of the timeframe the hours count from.
+    min_alt, sun_limit : float
+        Body altitude (deg) above and Sun altitude (deg) below which the body counts as visible.
+    start, end : numpy Array
+        Start and end of each window.
+    start_cause, end_cause : numpy Array of str
+        What opens and closes each window: 'rise' or 'dusk', 'set' or 'dawn', or 'edge' where the window is
+        cut by the end of the timeframe or by samples that were not evaluated.
+    transit, peak_alt : numpy Array
+        Time and altitude (deg) of the highest point of the body in each window.
+    """
+    def __init__(self, body, origin, start, end, start_cause, end_cause, transit, peak_alt, min_alt=0, sun_limit=-18):
+        self.body = body
+        self.origin = origin
+        self.start = np.asarray(start, dtype=float)
+        self.end = np.asarray(end, dtype=float)
+        self.start_cause = np.asarray(start_cause, dtype=str)
+        self.end_cause = np.asarray(end_cause, dtype=str)
+        self.transit = np.asarray(transit, dtype=float)
+        self.peak_alt = np.asarray(peak_alt, dtype=float)
+        self.min_alt = min_alt
+        self.sun_limit = sun_limit
+        self._order = {'peak_alt': np.argsort(-self.peak_alt, kind='stable'),
+                       'duration': np.argsort(self.start - self.end, kind='stable')}
+
+    @classmethod
+    def from_transformations(cls, tf, body, samples=None, min_alt=0, sun_limit=-18):
+        """
+        Finds the windows of a body from the tracks of a Transformations.
+
+        Parameters
+        ----------
+        tf : pqFrame.Transformations
+            Source of the time grid and the Sun and body tracks.
+        body : str
+            Body to index.
+        samples : numpy Array, optional
+            Sample indices to locate the body at, defaults to the night samples and one sample on either side,
+            which is all the root-finding needs. With fewer samples (e.g. an adaptive selection) windows are
+            only found among them.
+        min_alt : float
+            Body altitude (deg) the body has to be above.
+        sun_limit : float
+            Sun altitude (deg) the Sun has to be below.
+        """
+        key = body.lower()
+        samples = tf.night_samples(margin=1, sun_limit=sun_limit) if samples is None else samples
+        tf.locate(['sun', key], samples)
+
+        hours = tf.delta_time.to_value('hour')
+        dark = sun_limit - tf.body_tracks['sun']['alt']
+        up = tf.body_tracks[key]['alt'] - min_alt
+        visible = (dark > 0) & (up > 0)
+
+        # Runs of visible samples, from the first sample of each run to the last.
+        edges = np.diff(visible.astype(np.int8), prepend=0, append=0)
+        firsts, lasts = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1) - 1
+
+        windows = []
+        for first, last in zip(firsts, lasts):
+            start, start_cause, start_alt = _edge(hours, dark, up, first, first-1, ('dusk', 'rise'))
+            end, end_cause, end_alt = _edge(hours, dark, up, last, last+1, ('dawn', 'set'))
+            transit, peak = _peak(hours, up, first, last, [(start, start_alt), (end, end_alt)])
+            windows.append((start, end, start_cause, end_cause, transit, peak + min_alt))
+
+        columns = list(zip(*windows)) if windows else [[]]*6
+        return cls(key, tf.timeframe[0], *columns, min_alt=min_alt, sun_limit=sun_limit)
+
+    @classmethod
+    def cached(cls, tf, body, samples=None, min_alt=0, sun_limit=-18):
+        """
+        Returns the index of a body kept on tf.visibility, only finding the windows when the tracks changed.
+
+        The samples are located first (nothing is done for samples located before), and any new ones empty
+        tf.visibility, so the index always covers every sample located. Parameters are as in
+        from_transformations.
+        """
+        key = (body.lower(), min_alt, sun_limit)
+        samples = tf.night_samples(margin=1, sun_limit=sun_limit) if samples is None else samples
+        tf.locate(['sun', key[0]], samples)
+        index = tf.visibility.get(key)
+        if index is None:
+            index = cls.from_transformations(tf, body, samples, min_alt, sun_limit)
+            tf.visibility[key] = index
+        return index
+
+    def __len__(self):
+        return self.start.size
+
+    def hours(self, time):
+        """Converts astropy Time to hours since origin, passing numbers through."""
+
+        return (time - self.origin).to_value('hour') if isinstance(time, Time) else time
+
+    def time(self, hours):
+        """Converts hours since origin to astropy Time."""
+
+        return self.origin + np.asarray(hours)/24
+
+    def is_visible(self, t0=None, t1=None):
+        """Returns whether any window overlaps [t0, t1], or exists at all without bounds."""
+
+        if t0 is None and t1 is None:
+            return len(self) > 0
+        return len(self.between(t0, t1)) > 0
+
+    def at(self, t):
+        """Returns the position of the window containing time t, or -1 when the body is not visible then."""
+
+        t = self.hours(t)
+        i = int(np.searchsorted(self.start, t, side='right')) - 1
+        return i if i >= 0 and t <= self.end[i] else -1
+
+    def between(self, t0=None, t1=None):
+        """Returns the range of window positions overlapping [t0, t1], either bound open when None."""
+
+        lo = 0 if t0 is None else int(np.searchsorted(self.end, self.hours(t0), side='left'))
+        hi = len(self) if t1 is None else int(np.searchsorted(self.start, self.hours(t1), side='right'))
+        return range(lo, max(lo, hi))
+
+    def next(self, t):
+        """Returns the position of the window containing or following time t, or -1 when there is none."""
+
+        i = int(np.searchsorted(self.end, self.hours(t), side='left'))
+        return i if i < len(self) else -1
+
+    def best(self, n=1, by='peak_alt'):
+        """Returns the positions of the n best windows, by highest peak_alt or longest 'duration'."""
+
+        return self._order[by][:n]
+
+    def window(self, i):
+        """Returns one window as a dict with its start, end and transit as astropy Time."""
+
+        return {'body': self.body, 'start': self.time(self.start[i]), 'end': self.time(self.end[i]),
+                'start_cause': str(self.start_cause[i]), 'end_cause': str(self.end_cause[i]),
+                'transit': self.time(self.transit[i]), 'peak_alt': float(self.peak_alt[i]),
+                'hours': float(self.end[i] - self.start[i])}
+
+
+def _edge(hours, dark, up, inside, outside, causes):
+    # Time a window opens or closes between a visible sample and its neighbour, which condition does it and
+    # the body altitude there.
+    if outside < 0 or outside >= hours.size or np.isnan(dark[outside]) or np.isnan(up[outside]):
+        return hours[inside], 'edge', up[inside]
+    # The window is bounded by the crossing nearest the visible sample.
+    fraction, cause = min((f[inside]/(f[inside]-f[outside]), cause) for f, cause in zip((dark, up), causes)
+                          if f[outside] <= 0)
+    return (hours[inside] + fraction*(hours[outside]-hours[inside]), cause,
+            up[inside] + fraction*(up[outside]-up[inside]))
+
+def _peak(hours, up, first, last, edges):
+    # Highest point of the track in a window: one of its edges or the highest sample, refined by a parabola
+    # through its neighbours.
+    i = first + int(np.argmax(up[first:last+1]))
+    peak = (up[i], hours[i])
+    if first < i < last:
+        y0, y1, y2 = up[i-1:i+2]
+        curvature = y0 - 2*y1 + y2
+        if curvature < 0:
+            offset = 0.5*(y0 - y2)/curvature
+            peak = (y1 - 0.25*(y0 - y2)*offset, hours[i] + offset*(hours[i+1] - hours[i]))
+    alt, t = max([peak] + [(alt, t) for t, alt in edges])
+    return t, alt
@@ -0,0 +1,313 @@
+import os
+import json
+import time
+import threading
+import numpy as np
+import requests
+import pqInstrument
+import pqExecutor
+from datetime import date
+from requests.adapters import HTTPAdapter
+
+CACHE_DIR = os.environ.get('PYQUAZA_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.pyquaza'))
+
+class OpenWeatherMap:
+    """
+    Weather backend pulling daily percent cloud coverage from the OpenWeatherMap daily forecast API.
+
+    Requests go through one keep-alive requests.Session, so repeated lookups reuse pooled connections.
+
+    Parameters
+    ----------
+    appid : str
+        OpenWeatherMap API key.
+    url : str
+        Daily forecast endpoint. Point this at a local stub server to run without the live API.
+    timeout : float or tuple
+        Connect/read timeout in seconds passed to requests.
+    pool_size : int
+        Number of pooled connections kept per host.
+    """
+    def __init__(self, appid="ece9f5354fef610b3f4ac8e96a6a4895",
+                 url="https://api.openweathermap.org/data/2.5/forecast/daily",
+                 timeout=(3.05, 10), pool_size=10):
+        self.appid = appid
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def fetch(self, lat, long, days=7):
+        """Returns the list of daily percent cloud coverage values starting today."""
+
+        params = {'lat': lat, 'lon': long, 'cnt': days, 'appid': self.appid, 'units': 'imperial'}
+        response = self.session.get(self.url, params=params, timeout=self.timeout)
+        response.raise_for_status()
+
+        return [day['clouds'] for day in response.json()['list']]
+
+
+class FixtureBackend:
+    """
+    Weather backend serving a recorded response from disk instead of calling OpenWeatherMap.
+
+    Parameters
+    ----------
+    path : str
+        JSON file holding either a raw OpenWeatherMap daily forecast response ({"list": [...]})
+        or a plain {"clouds": [...]} record. The same values are returned for every location.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path) as f:
+            results = json.load(f)
+        if 'list' in results:
+            self.values = [day['clouds'] for day in results['list']]
+        else:
+            self.values = list(results['clouds'])
+
+    def fetch(self, lat, long, days=7):
+        """Returns the recorded daily percent cloud coverage values."""
+
+        return self.values[:days]
+
+
+class RateLimiter:
+    """
+    Spaces calls shared between threads at least 1/rate seconds apart.
+
+    Parameters
+    ----------
+    rate : float
+        Maximum number of calls per second.
+    """
+    def __init__(self, rate):
+        self.interval = 1/rate
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """Blocks until the calling thread may make its next call."""
+
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        time.sleep(slot - now)
+
+
+class WeatherProvider:
+    """
+    Cached access to daily cloud coverage forecasts.
+
+    Forecasts are kept in memory and as JSON files on disk, keyed by latitude/longitude rounded to
+    `precision` decimals and the date the forecast was issued. An entry younger than `ttl` seconds is
+    returned as-is. An entry older than that but within `ttl + stale_ttl` is still returned immediately
+    while a background thread fetches a fresh copy (stale-while-revalidate). Anything older is fetched
+    before returning.
+
+    Parameters
+    ----------
+    backend : object, optional
+        Anything with a fetch(lat, long, days) method returning daily cloud coverage, defaults to OpenWeatherMap.
+    cache_dir : str, optional
+        Directory for the on-disk cache, None keeps the cache in memory only.
+    ttl : float
+        Seconds a forecast is considered fresh.
+    stale_ttl : float
+        Extra seconds a stale forecast may still be served while it is refreshed.
+    precision : int
+        Decimals latitude and longitude are rounded to before lookup.
+    days : int
+        Number of forecast days requested.
+    """
+    def __init__(self, backend=None, cache_dir=os.path.join(CACHE_DIR, 'weather'),
+                 ttl=3*3600, stale_ttl=21*3600, precision=1, days=7):
+        self.backend = backend if backend is not None else OpenWeatherMap()
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.precision = precision
+        self.days = days
+        self.hits = 0
+        self.misses = 0
+        self._memory = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def key(self, lat, long, day=None):
+        """Returns the cache key for a location and forecast date."""
+
+        day = date.today() if day is None else day
+        return (round(float(lat), self.precision), round(float(long), self.precision), day.isoformat())
+
+    def clouds(self, lat, long, day=None):
+        """
+        Returns the daily percent cloud coverage forecast for a location as a numpy Array.
+
+        Parameters
+        ----------
+        lat : float
+            Latitude of the viewing location in degrees.
+        long : float
+            Longitude of the viewing location in degrees.
+        day : datetime date, optional
+            Date the forecast is issued on, defaults to today.
+        """
+        key = self.key(lat, long, day)
+        entry = self._lookup(key)
+        age = time.time() - entry['fetched'] if entry is not None else None
+
+        if entry is None or age >= self.ttl + self.stale_ttl:
+            self.misses += 1
+            pqInstrument.count('weather_misses')
+            with pqInstrument.span('weather_fetch'):
+                entry = self._fetch(key)
+        else:
+            self.hits += 1
+            pqInstrument.count('weather_hits')
+            if age >= self.ttl:
+                self._revalidate(key)
+
+        return np.array(entry['clouds'])
+
+    def bulk_clouds(self, lats, longs, day=None, concurrency=8, rate=None, retries=2, backoff=0.5):
+        """
+        Returns the daily percent cloud coverage forecasts of many locations as one (site, day) numpy Array.
+
+        Locations that round to the same cache key are fetched once, and only keys without a usable cached
+        forecast reach the backend, concurrently on a pool of `concurrency` threads. The fetched forecasts are
+        cached as by clouds(), so Transformations created for the same sites afterwards find them there. The
+        timeout of each request is the backend's (see OpenWeatherMap). Forecasts shorter than `days` repeat
+        their last day. If a key still fails after its retries, the first such error is raised once every
+        other key has been fetched.
+
+        Parameters
+        ----------
+        lats, longs : array_like
+            Latitudes and longitudes of the locations in degrees.
+        day : datetime date, optional
+            Date the forecasts are issued on, defaults to today.
+        concurrency : int
+            Maximum number of requests in flight.
+        rate : float, optional
+            Maximum number of requests started per second, unlimited if None.
+        retries : int
+            Extra attempts for a request failing with a connection error, timeout, 429 or 5xx response.
+        backoff : float
+            Seconds to wait before the first retry, doubling with every further one.
+        """
+        keys = [self.key(lat, long, day) for lat, long in zip(np.ravel(lats), np.ravel(longs))]
+        entries = {}
+        missing = []
+        for key in dict.fromkeys(keys):
+            entry = self._lookup(key)
+            age = time.time() - entry['fetched'] if entry is not None else None
+            if entry is None or age >= self.ttl + self.stale_ttl:
+                missing.append(key)
+                continue
+            entries[key] = entry
+            if age >= self.ttl:
+                self._revalidate(key)
+        self.hits += len(entries)
+        self.misses += len(missing)
+        pqInstrument.count('weather_hits', len(entries))
+        pqInstrument.count('weather_misses', len(missing))
+
+        if missing:
+            limiter = RateLimiter(rate) if rate is not None else None
+            with pqInstrument.span('weather_bulk_fetch', keys=len(missing)):
+                results = pqExecutor.run_map(self._fetch_retrying, [(key, limiter, retries, backoff) for key in missing],
+                                             'thread', concurrency)
+            errors = [result for result in results if isinstance(result, Exception)]
+            if errors:
+                raise errors[0]
+            entries.update(zip(missing, results))
+
+        clouds = np.empty((len(keys), self.days))
+        for i, key in enumerate(keys):
+            values = entries[key]['clouds'][:self.days]
+            clouds[i] = np.pad(values, (0, self.days - len(values)), mode='edge')
+        return clouds
+
+    def _fetch_retrying(self, key, limiter, retries, backoff):
+        # Runs on a pool thread, so a failure is returned instead of raised to let the other keys finish.
+        for attempt in range(retries + 1):
+            if limiter is not None:
+                limiter.wait()
+            try:
+                return self._fetch(key)
+            except requests.RequestException as err:
+                status = err.response.status_code if err.response is not None else None
+                if attempt == retries or (status is not None and status != 429 and status < 500):
+                    return err
+            except (KeyError, ValueError, OSError) as err:
+                return err
+            time.sleep(backoff * 2**attempt)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key[2]}_{key[0]:+.{self.precision}f}_{key[1]:+.{self.precision}f}.json")
+
+    def _lookup(self, key):
+        entry = self._memory.get(key)
+        if entry is None and self.cache_dir is not None:
+            try:
+                with open(self._path(key)) as f:
+                    entry = json.load(f)
+            except (OSError, ValueError):
+                return None
+            self._memory[key] = entry
+        return entry
+
+    def _fetch(self, key):
+        entry = {'fetched': time.time(), 'clouds': list(self.backend.fetch(key[0], key[1], self.days))}
+        self._memory[key] = entry
+        if self.cache_dir is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            path = self._path(key)
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, 'w') as f:
+                json.dump(entry, f)
+            os.replace(tmp, path)
+        return entry
+
+    def _revalidate(self, key):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                self._fetch(key)
+            except (requests.RequestException, OSError, KeyError, ValueError):
+                pass
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+
+_default_provider = None
+
+def default_provider():
+    """
+    Returns the process-wide WeatherProvider used by pqFrame.Transformations.
+
+    Setting the PYQUAZA_WEATHER_FIXTURE environment variable to a recorded response file makes the
+    default provider serve that file instead of calling OpenWeatherMap.
+    """
+    global _default_provider
+    if _default_provider is None:
+        fixture = os.environ.get('PYQUAZA_WEATHER_FIXTURE')
+        backend = FixtureBackend(fixture) if fixture else None
+        _default_provider = WeatherProvider(backend=backend)
+    return _default_provider
+
+def set_default_provider(provider):
+    """Replaces the process-wide WeatherProvider, e.g. with one using a stub backend."""
+    global _default_provider
+    _default_provider = provider
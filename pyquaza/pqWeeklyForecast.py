@@ -1,20 +1,47 @@
 import pqFrame as pq
 import pqBodyForecast as bf
-import pandas as pd
+import pqInstrument
+import pqSamples
 import numpy as np
 
+# Available body set to view.
+BODY_SET = ['moon','mercury','venus','mars','jupiter','saturn','uranus','neptune']
+
+# Define max and min distances of each body from earth (in AU).
+max_dist = {'moon':0.0027,'mercury':1.485,'venus':1.738,'mars':2.680,'jupiter':6.465,'saturn':10.758,'uranus':21.3,'neptune':30.122}
+min_dist = {'moon':0.0024,'mercury':0.308,'venus':0.267,'mars':0.385,'jupiter':3.927,'saturn':8.025,'uranus':17.212,'neptune':29.046}
+
+def distance_reward(bodies, dist):
+    """ Reward bodies that are close to earth compared to their usual range
+    
+        Args: List of body names and their distances from earth (in AU)
+        
+        Returns: Array of rewards, the highest one marks the best body
+    """
+    dist_avg = (np.array([max_dist[b] for b in bodies])-np.array([min_dist[b] for b in bodies]))/2
+    return 1 - (np.asarray(dist, dtype=float)/dist_avg)
+
 class WeeklyForecast:
     
-    def __init__(self,lat,long):
+    def __init__(self,lat,long,cost=bf.cost_fx,tf=None,executor='serial',workers=None,image_file='body.png',grid=None):
         self.lat = lat
         self.long = long
-        self.tf = pq.Transformations(self.lat,self.long)
+        self.cost = cost
+        self.image_file = image_file
+        self.tf = tf if tf is not None else pq.sky_session(self.lat,self.long)
+        
+        "pqGlobe.GlobeGrid to look best times up in (see BodyForecast)"
+        self.grid = grid
+        
+        "Executor fanning the per-body work out ('serial', 'thread' or 'process')"
+        self.executor = executor
+        self.workers = workers
         
         "Define available body set to view"
-        self.body_set = ['moon','mercury','venus','mars','jupiter','saturn','uranus','neptune']
+        self.body_set = list(BODY_SET)
 
         
-    def milkyway_this_week(self):
+    def milkyway_this_week(self, progress=None):
         """ Create milkyway_this_week function
             
             This function gathers uses data for sun altitude, timeframe give (a week),
@@ -23,78 +50,93 @@ class WeeklyForecast:
             The cost function used in this function takes into account body altitude, 
             body distance compared to max and min distance values, and the cloud coverage
             at the location during the timeframe.
+            If given, progress(body, forecast) is called with each body name
+            and this forecast before that body is evaluated (and with
+            'locate' before the bodies are located together by a thread
+            or process executor). An exception raised by progress stops
+            the evaluation.
+            When a pqGlobe.GlobeGrid holds the site, every body's best time
+            is looked up there instead (self.grid_best).
         """
-        # Create DataFrame of celestial body locations in the backyard frames
-        
-        sun_altaz = self.tf.sun_for_me()
-        timeframe = self.tf.timeframe
-        delta_time = self.tf.delta_time
-        clouds = self.tf.check_weather()
-        
-        # Define max and min distances of each body from earth (in AU).
-        max_dist = np.array([0.0027,1.485,1.738,2.680,6.465,10.758,21.3,30.122])
-        min_dist = np.array([0.0024,0.308,0.267,0.385,3.927,8.025,17.212,29.046])
-        
-        # Assign columns for dataframe that will be used
-        df_best_time = pd.DataFrame(columns=['day','month','year','hour','minute','deltahrs','sunalt','bodyalt','bodyaz','bodydist','clouds','body'])
+        with pqInstrument.span('milkyway_this_week'):
+            grid = bf.grid_for(self.tf, self.cost, self.grid)
+            if grid is not None:
+                clouds = self.tf.check_weather()
+                hits = [grid.best(self.lat, self.long, body, clouds, self.cost) for body in self.body_set]
+                if all(hit is not None for hit in hits):
+                    self.grid_best = dict(zip(self.body_set, hits))
+                    reward = distance_reward(self.body_set, [hit['distance'] for hit in hits])
+                    return self.body_set[int(np.argmax(reward))]
+            self.grid_best = None
+            return self._milkyway_this_week(progress)
+    
+    def _milkyway_this_week(self, progress):
+        # With dense sampling every body uses the same night samples, so
+        # transform them all up front, in one astropy call or one worker
+        # per body. A serial run with a progress callback locates body by
+        # body in the loop below instead, so every body is reported and
+        # the callback can stop the run between them; a fanned out run
+        # reports the batch as the 'locate' stage.
+        if self.tf.sampling == 'dense' and (progress is None or self.executor != 'serial'):
+            if progress is not None:
+                progress('locate', self)
+            self.tf.locate(self.body_set, self.tf.night_samples(),
+                           executor=self.executor, workers=self.workers)
         
-        # Create dictionary that will be used to add data to dataframe.
+        # Locate the Sun first and only evaluate each body during
+        # astronomical night (or the samples an adaptive tf refines).
+        evaluated = []
         for i,body in enumerate(self.body_set):
+            if progress is not None:
+                progress(body, self)
             
-            body_altaz = self.tf.in_my_sky(body)
-            per_body = []
-            per_body = {'day': timeframe.ymdhms.day,
-                        'month': timeframe.ymdhms.month,
-                        'year': timeframe.ymdhms.year,
-                        'hour': timeframe.ymdhms.hour,
-                        'minute': timeframe.ymdhms.minute,
-                        'deltahrs' : delta_time,
-                        'sunalt': sun_altaz.alt,
-                        'bodyalt' :body_altaz.alt,
-                        'bodyaz' : body_altaz.az,
-                        'bodydist': body_altaz.distance,
-                        'clouds': np.repeat(clouds,288),
-                        'body': body
-                        }
-            # Create dataframe.   
-            df_body = pd.DataFrame(per_body)
-            # Remove data for daytime by masking values where sun is above -18 deg altitude.
-            df_body_night = df_body[df_body['sunalt']<-18]
-
-            cost = []
-            
-            # Generate for loop to run all data in dataframe through cost function
-            # and find best time, and best time index within dataframe.
-            for idx in df_body_night.index:
-                cost_val =  100*(df_body_night.clouds[idx])+10*abs(df_body_night.bodyalt[idx]-40) #+ 100*((max_dist[i]-min_dist[i])/2 - df_body_night.bodydist[idx])        
-                cost.append(cost_val)
-            
-            i_best_time = cost.index(min(cost))
-            df_best_time.loc[len(df_best_time.index)] = df_body_night.iloc[i_best_time]
+            with pqInstrument.span(body):
+                samples = self.tf.samples_for(body, self.cost)
+                self.tf.locate(['sun', body], samples)
+                pqInstrument.count('samples', len(samples))
+            evaluated.append(samples)
+        
+        # Collect every body into one (body x sample) block over all samples
+        # evaluated, each body only holding values at its own samples, and
+        # remove data for daytime where the sun is above -18 deg altitude.
+        axis = np.unique(np.concatenate(evaluated))
+        self.block = pqSamples.SampleBlock.from_transformations(self.tf, self.body_set, axis, evaluated).night()
+        pqInstrument.count('night_samples', len(self.block))
+        
+        # Run all night data through the cost function at once and find
+        # the best time of every body.
+        self.i_best = np.argmin(self.block.cost(self.cost), axis=1)
         
-        reward = []
-    
         # Take into account distance, reward max value from formula for best 
         # Distance for planet during observation timeframe
-        for idx in df_best_time.index:
-            dist_avg = (max_dist[idx]-min_dist[idx])/2
-            
-            reward.append(1 - (df_best_time.bodydist[idx]/dist_avg))
+        dist = self.block.distance[np.arange(len(self.body_set)), self.i_best]
+        reward = distance_reward(self.body_set, dist)
         
-        i_best_body = reward.index(max(reward))
+        i_best_body = int(np.argmax(reward))
         
-        best_body = df_best_time.iloc[i_best_body].body
+        best_body = self.body_set[i_best_body]
         
         return best_body
     
-    def get_plot(self):
+    def get_plot(self, progress=None, timer=None):
         """ Create get_plot function
         
             Plot results for the body found to be the best to observe this week.
-            This uses the plotting function from BodyForecast.
+            This uses the plotting function from BodyForecast, which shares
+            this forecast's pq.Transformations so the sun track, weather and
+            best body's track are not computed a second time. The plot is
+            saved to image_file, or kept in memory in self.image if it is None.
+            progress is passed on to milkyway_this_week and BodyForecast.run_all,
+            and is called with 'best_body' once self.best_body is known.
+            timer takes a pqInstrument.Timer recording every stage and body
+            as in BodyForecast.run_all.
         """
-        best_body = self.milkyway_this_week()
-        bf1 = bf.BodyForecast(self.lat,self.long,best_body)
-        bf1.run_all()
+        with pqInstrument.activate(timer), pqInstrument.span('get_plot'):
+            self.best_body = self.milkyway_this_week(progress)
+            if progress is not None:
+                progress('best_body', self)
+            bf1 = bf.BodyForecast(self.lat,self.long,self.best_body,cost=self.cost,tf=self.tf,image_file=self.image_file,grid=self.grid)
+            bf1.run_all(progress)
         self.fig = bf1.fig
+        self.image = bf1.image
         self.figText = bf1.figText
\ No newline at end of file
@@ -0,0 +1,24 @@
+import os
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'pyquaza'))
+
+import pqWeather
+import pqEphemeris
+import pqData
+
+# Recorded weather response the benchmarks also run on, so no test calls OpenWeatherMap.
+FIXTURE = os.path.join(ROOT, 'benchmarks', 'weather_fixture.json')
+
+# Earth rotation tables come from the bundle or astropy's own copy rather than the network.
+pqData.configure(offline=True)
+
+@pytest.fixture(scope='session')
+def weather():
+    return pqWeather.WeatherProvider(backend=pqWeather.FixtureBackend(FIXTURE), cache_dir=None)
+
+@pytest.fixture(scope='session')
+def ephemeris(tmp_path_factory):
+    return pqEphemeris.EphemerisStore(str(tmp_path_factory.mktemp('ephemeris')))
@@ -0,0 +1,22 @@
+from datetime import date
+import pytest
+import pqFrame as pq
+import pqBodyForecast as bf
+
+START = date(2024, 3, 1)
+SITES = [(24, -85), (51.5, -0.1), (-33.9, 151.2), (64.1, -21.9)]
+BODIES = ['moon', 'mars', 'jupiter', 'saturn']
+
+def best_sample(lat, long, body, sampling, weather, ephemeris):
+    tf = pq.Transformations(lat, long, START, weather=weather, ephemeris=ephemeris, sampling=sampling)
+    forecast = bf.BodyForecast(lat, long, body, tf=tf, image_file=None, grid=False)
+    for stage in ['body_this_week', 'set_body_df', 'cut_daytime', 'best_time']:
+        getattr(forecast, stage)()
+    return int(forecast.night_block.samples[forecast.i_best])
+
+@pytest.mark.parametrize('lat, long', SITES)
+@pytest.mark.parametrize('body', BODIES)
+def test_adaptive_best_time_within_one_step(lat, long, body, weather, ephemeris):
+    dense = best_sample(lat, long, body, 'dense', weather, ephemeris)
+    adaptive = best_sample(lat, long, body, 'adaptive', weather, ephemeris)
+    assert abs(adaptive - dense) <= 1
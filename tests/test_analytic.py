@@ -0,0 +1,23 @@
+from datetime import date
+import pytest
+import pqAnalytic
+
+# Largest alt/az separation (arcmin) from astropy allowed for each body, and the relative distance error.
+ARCMIN = {'moon': 5, **{body: 2 for body in pqAnalytic.BODIES if body != 'moon'}}
+DISTANCE = 0.005
+
+@pytest.fixture(scope='module', params=[(24, -85, date(2024, 1, 1)), (-45, 170, date(2026, 1, 1))],
+                ids=['24N-2024', '45S-2026'])
+def errors(request, ephemeris):
+    # A year at 6-hour steps, which sees every lunar and planetary configuration the short terms depend on.
+    lat, long, start = request.param
+    return pqAnalytic.compare_with_astropy(lat, long, start, hours=366*24, n_samples=366*4+1,
+                                           ephemeris=ephemeris)
+
+@pytest.mark.parametrize('body', pqAnalytic.BODIES)
+def test_angular_error(errors, body):
+    assert errors[body]['arcmin'] < ARCMIN[body]
+
+@pytest.mark.parametrize('body', pqAnalytic.BODIES)
+def test_distance_error(errors, body):
+    assert errors[body]['distance'] < DISTANCE
@@ -0,0 +1,36 @@
+from datetime import date
+import pytest
+import pqFrame as pq
+import pqBodyForecast as bf
+import pqWeeklyForecast as wf
+import pqSites
+
+START = date(2024, 3, 1)
+SITES = [(24, -85), (51.5, -0.1), (-33.9, 151.2)]
+
+@pytest.fixture(scope='module')
+def per_site(weather, ephemeris):
+    # Best sample of every body and the weekly best body at each site, from the per-site classes.
+    results = []
+    for lat, long in SITES:
+        best = {}
+        for body in wf.BODY_SET:
+            tf = pq.Transformations(lat, long, START, weather=weather, ephemeris=ephemeris)
+            forecast = bf.BodyForecast(lat, long, body, tf=tf, image_file=None, grid=False)
+            for stage in ['body_this_week', 'set_body_df', 'cut_daytime', 'best_time']:
+                getattr(forecast, stage)()
+            best[body] = int(forecast.best_time_val.name)
+        tf = pq.Transformations(lat, long, START, weather=weather, ephemeris=ephemeris)
+        weekly = wf.WeeklyForecast(lat, long, tf=tf, image_file=None, grid=False).milkyway_this_week()
+        results.append((best, weekly))
+    return results
+
+@pytest.mark.parametrize('executor', ['serial', 'thread'])
+def test_forecast_sites_matches_per_site_classes(executor, per_site, weather, ephemeris):
+    lats, longs = zip(*SITES)
+    table = pqSites.forecast_sites(lats, longs, start=START, weather=weather, ephemeris=ephemeris,
+                                   executor=executor, workers=2, chunk=2)
+    for site, (best, weekly) in enumerate(per_site):
+        rows = table[table['site'] == site].set_index('body')['sample']
+        assert rows.to_dict() == best
+        assert pqSites.best_bodies(table)[site] == weekly
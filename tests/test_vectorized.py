@@ -0,0 +1,44 @@
+from datetime import date
+import pytest
+import pqFrame as pq
+import pqBodyForecast as bf
+import pqWeeklyForecast as wf
+
+START = date(2024, 3, 1)
+SITES = [(24, -85), (51.5, -0.1), (-33.9, 151.2)]
+
+def session(lat, long, weather, ephemeris):
+    return pq.Transformations(lat, long, START, weather=weather, ephemeris=ephemeris)
+
+def scalar_best(tf, body):
+    # The per-row loop the vectorized cost replaced: every night sample through cost_fx, first minimum wins.
+    tf.locate(['sun', body])
+    sunalt, bodyalt = tf.body_tracks['sun']['alt'], tf.body_tracks[body]['alt']
+    clouds = tf.clouds_for()
+    night = [i for i in range(len(sunalt)) if sunalt[i] < -18]
+    cost = []
+    for i in night:
+        cost.append(bf.cost_fx(clouds[i], bodyalt[i]))
+    return night[cost.index(min(cost))]
+
+@pytest.mark.parametrize('lat, long', SITES)
+@pytest.mark.parametrize('body', ['moon', 'venus', 'jupiter', 'saturn'])
+def test_best_time_matches_scalar_loop(lat, long, body, weather, ephemeris):
+    tf = session(lat, long, weather, ephemeris)
+    forecast = bf.BodyForecast(lat, long, body, tf=tf, image_file=None, grid=False)
+    for stage in ['body_this_week', 'set_body_df', 'cut_daytime', 'best_time']:
+        getattr(forecast, stage)()
+    assert forecast.best_time_val.name == scalar_best(tf, body)
+
+@pytest.mark.parametrize('lat, long', SITES)
+def test_weekly_body_matches_scalar_loop(lat, long, weather, ephemeris):
+    tf = session(lat, long, weather, ephemeris)
+    reward = []
+    for body in wf.BODY_SET:
+        i = scalar_best(tf, body)
+        dist_avg = (wf.max_dist[body]-wf.min_dist[body])/2
+        reward.append(1 - (tf.body_tracks[body]['distance'][i]/dist_avg))
+    expected = wf.BODY_SET[reward.index(max(reward))]
+
+    weekly = wf.WeeklyForecast(lat, long, tf=session(lat, long, weather, ephemeris), image_file=None, grid=False)
+    assert weekly.milkyway_this_week() == expected